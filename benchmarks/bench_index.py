@@ -0,0 +1,86 @@
+"""
+Compares time to index album directory with mutagen and with header-only id3 scanner, and time to refresh
+index after one track was added to it.
+
+Tracks are generated without ffmpeg, every one has a large cover frame written before album and track frames.
+
+Usage: python -m benchmarks.bench_index [--tracks N] [--cover-size BYTES] [--dir PATH]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import mutagen.id3
+
+from core import constants
+from core import index
+
+
+ALBUM = 'benchmark'
+# silent mpeg frames, enough for mutagen to recognize file as mp3
+MPEG_FRAMES = (b'\xff\xfb\x90\x64' + b'\x00' * 413) * 20
+
+
+def generate_track(directory, track_num, cover_data):
+    video_id = 'bench{0:06d}'.format(track_num)
+    path = os.path.join(directory, '{0} [{1}].mp3'.format(track_num, video_id))
+    with open(path, 'wb') as audio_file:
+        audio_file.write(MPEG_FRAMES)
+
+    tags = mutagen.id3.ID3()
+    tags.add(mutagen.id3.APIC(encoding=3, mime='image/jpeg', type=3, data=cover_data))
+    tags.add(mutagen.id3.TALB(encoding=3, text=ALBUM))
+    tags.add(mutagen.id3.TRCK(encoding=3, text=str(track_num)))
+    tags.add(mutagen.id3.TXXX(encoding=3, desc=constants.VIDEO_ID_TAG, text=video_id))
+    tags.save(path)
+
+    return path
+
+
+def read_with_mutagen(path):
+    tags = mutagen.id3.ID3(path)
+    return tags.get('TALB'), tags.get('TRCK')
+
+
+def time_it(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time to index album directory')
+    parser.add_argument('--tracks', type=int, default=2000, help='Number of tracks in album directory')
+    parser.add_argument('--cover-size', type=int, default=100 * 1024, help='Size of cover frame, bytes')
+    parser.add_argument('--dir', default=None, help='Directory for generated files')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='ytmp3_bench_', dir=args.dir)
+    try:
+        cover_data = os.urandom(args.cover_size)
+        paths = [generate_track(directory, track_num, cover_data) for track_num in range(1, args.tracks + 1)]
+
+        results = [
+            ('mutagen, serial', time_it(lambda: [read_with_mutagen(path) for path in paths])),
+            ('scanner, serial', time_it(lambda: [index.read_audio_tags(path) for path in paths])),
+        ]
+
+        local_index = index.LocalIndex(directory)
+        results.append(('index, cold', time_it(local_index.refresh)))
+        generate_track(directory, args.tracks + 1, cover_data)
+        results.append(('index, one added', time_it(local_index.refresh)))
+        last_track_number = local_index.get_last_track_number(ALBUM)
+        local_index.close()
+
+        print('{0:<20} {1:>10}'.format('method', 'seconds'))
+        for name, seconds in results:
+            print('{0:<20} {1:>10.3f}'.format(name, seconds))
+        print('last track number = {0}'.format(last_track_number))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+End-to-end benchmark of playlist paging, synchronization, videos availability check, download, conversion
+and tagging against local stub server, reports throughput and peak memory for every playlist size.
+
+Every size runs in its own process, so peak RSS is not shared between sizes.
+
+Usage: python -m benchmarks.bench_pipeline [--sizes 10,100,1000] [--jobs N] [--stages full|paging]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from core import constants
+
+
+# per host rate used against local stub server, requests are not limited like real api
+BENCH_HOST_RATE = 10000.0
+
+def run_one(args):
+    # imported here, so parent process stays small and does not load pipeline modules
+    from benchmarks.stub_server import PLAYLIST_ID_FRMT
+    from core import index
+    from core import metrics
+    from core import scheduler
+    from core import util
+    from core import youtubeservice
+    from core.downloader import session
+
+    youtubeservice.YOUTUBE_API_URL = args.api_url
+    youtubeservice.YOUTUBE_WATCH_URL = args.watch_url_frmt
+    constants.HD_THUMB_URL_FRMT = args.thumb_url_frmt
+    # everything is served by single local host, default per host rate would measure rate limiter only
+    scheduler.configure_scheduler(host_rate=BENCH_HOST_RATE)
+
+    run_metrics = metrics.RunMetrics()
+    youtubeservice.set_run_metrics(run_metrics)
+
+    playlist_id = PLAYLIST_ID_FRMT.format(args.size)
+    working_dir = tempfile.mkdtemp(prefix='ytmp3_bench_', dir=args.dir)
+    try:
+        started = time.perf_counter()
+
+        util.create_temp_dir(working_dir)
+        youtubeservice.get_playlist_info('benchmark', playlist_id)
+        videos = youtubeservice.get_videos_from_playlist('benchmark', playlist_id)
+        video_info_list = youtubeservice.get_playlist_video_info(youtubeservice.synchronize_audios(videos,
+                                                                                                 working_dir))
+        video_info_list = youtubeservice.get_playable_videos('benchmark', video_info_list)
+        if args.stages == 'paging':
+            items = sum(1 for _ in video_info_list)
+        else:
+            youtubeservice.save_mp3(video_info_list, working_dir, album='benchmark', jobs=args.jobs,
+                                    audio_format=args.audio_format)
+            items = len([filename for filename in os.listdir(working_dir)
+                         if filename.endswith(constants.AUDIO_EXTENSIONS)])
+
+        elapsed = time.perf_counter() - started
+        run_metrics.finish()
+    finally:
+        index.close_indexes()
+        session.close_default_session()
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+    stages = dict((stage, {'p50': stage_report['wall']['p50'], 'p95': stage_report['wall']['p95']})
+                  for stage, stage_report in run_metrics.report()['stages'].items() if 'wall' in stage_report)
+
+    return {
+        'size': args.size,
+        'items': items,
+        'seconds': elapsed,
+        'items_per_second': items / elapsed if elapsed else 0,
+        # linux reports kilobytes
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        'stages': stages
+    }
+
+
+def run_sizes(args):
+    from benchmarks.stub_server import StubServer
+
+    media_dir = tempfile.mkdtemp(prefix='ytmp3_bench_media_', dir=args.dir)
+    server = StubServer(media_dir if args.stages == 'full' else None, duration=args.duration).start()
+    try:
+        results = []
+        for size in args.sizes:
+            command = [sys.executable, '-m', 'benchmarks.bench_pipeline', '--child', '--size', str(size),
+                       '--jobs', str(args.jobs), '--stages', args.stages, '--format', args.audio_format,
+                       '--api-url', server.api_url, '--watch-url', server.watch_url_frmt,
+                       '--thumb-url', server.thumb_url_frmt]
+            if args.dir:
+                command += ['--dir', args.dir]
+
+            process = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+            results.append(json.loads(process.stdout.decode('utf-8').strip().splitlines()[-1]))
+    finally:
+        server.stop()
+        shutil.rmtree(media_dir, ignore_errors=True)
+
+    return results
+
+
+def print_results(results):
+    print('{0:>8} {1:>8} {2:>10} {3:>10} {4:>12}  {5}'.format('size', 'items', 'seconds', 'items/s', 'peak rss mb',
+                                                              'stage p50/p95, s'))
+    for result in results:
+        stages = ', '.join('{0} {1:.3f}/{2:.3f}'.format(stage, values['p50'], values['p95'])
+                           for stage, values in result['stages'].items())
+        print('{size:>8} {items:>8} {seconds:>10.2f} {items_per_second:>10.2f} {peak_rss_mb:>12.1f}  '.format(**result)
+              + stages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark with local stub server')
+    parser.add_argument('--sizes', default='10,100,1000',
+                        type=lambda value: [int(size) for size in value.split(',')],
+                        help='Comma separated playlist sizes')
+    parser.add_argument('--jobs', type=int, default=constants.DEFAULT_JOBS, help='Number of parallel downloads')
+    parser.add_argument('--stages', choices=['full', 'paging'], default='full',
+                        help='Run whole pipeline or only playlist paging and synchronization')
+    parser.add_argument('--format', dest='audio_format', choices=constants.OUTPUT_AUDIO_FORMATS,
+                        default=constants.DEFAULT_AUDIO_FORMAT, help='Output audio format')
+    parser.add_argument('--duration', type=int, default=30, help='Duration of generated audio, seconds')
+    parser.add_argument('--dir', default=None, help='Directory for temporary working directories')
+    parser.add_argument('--json', dest='json_path', default=None, help='Path to save results as JSON')
+    # arguments of single size run in child process
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', dest='api_url', help=argparse.SUPPRESS)
+    parser.add_argument('--watch-url', dest='watch_url_frmt', help=argparse.SUPPRESS)
+    parser.add_argument('--thumb-url', dest='thumb_url_frmt', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(args)))
+        return
+
+    results = run_sizes(args)
+    print_results(results)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
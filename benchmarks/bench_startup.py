@@ -0,0 +1,119 @@
+"""
+Startup time of the script for '-h' and for synchronization of playlist which has nothing to download,
+the last one runs against local stub server. Reports wall time, total import time taken from
+'python -X importtime' and slowest top level imports, heavy modules should not be loaded on these paths.
+
+Usage: python -m benchmarks.bench_startup [--runs N] [--top N] [--json PATH]
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ytmp3.py')
+# modules which are needed only to download or tag audio
+HEAVY_MODULES = ['yt_dlp', 'mutagen']
+
+
+def run_sync(args):
+    # youtube service is imported by script anyway, api url is changed before script starts
+    from core import youtubeservice
+
+    youtubeservice.YOUTUBE_API_URL = args.api_url
+
+    sys.argv = [SCRIPT_PATH, '-k', 'benchmark', '-p', args.playlist, '-f', args.folder,
+                '--no-cache', '-q']
+    runpy.run_path(SCRIPT_PATH, run_name='__main__')
+
+
+def parse_importtime(output):
+    """ returns cumulative time in microseconds of every top level import and names of all imported modules """
+    top_imports = dict()
+    modules = set()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        # nested imports are indented
+        if not name[1:].startswith(' '):
+            top_imports[name.strip()] = int(cumulative)
+
+    return top_imports, modules
+
+
+def measure(command, runs, env):
+    walls = []
+    totals = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, check=True)
+        walls.append(time.perf_counter() - started)
+
+        top_imports, modules = parse_importtime(process.stderr.decode('utf-8', 'replace'))
+        totals.append(sum(top_imports.values()))
+
+    return {
+        'wall_ms': statistics.median(walls) * 1000,
+        'import_ms': statistics.median(totals) / 1000.0,
+        'heavy_modules': [module for module in HEAVY_MODULES if module in modules],
+        'top_imports': sorted(top_imports.items(), key=lambda item: item[1], reverse=True)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of the script')
+    parser.add_argument('--runs', type=int, default=5, help='Number of runs of every scenario, median is reported')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest top level imports to print')
+    parser.add_argument('--json', dest='json_path', default=None, help='Path to save results as JSON')
+    # arguments of synchronization run in child process
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', dest='api_url', help=argparse.SUPPRESS)
+    parser.add_argument('--playlist', help=argparse.SUPPRESS)
+    parser.add_argument('--folder', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_sync(args)
+        return
+
+    from benchmarks.stub_server import PLAYLIST_ID_FRMT
+    from benchmarks.stub_server import StubServer
+
+    directory = tempfile.mkdtemp(prefix='ytmp3_bench_')
+    server = StubServer().start()
+    try:
+        env = dict(os.environ, XDG_CACHE_HOME=os.path.join(directory, 'cache'))
+        scenarios = [
+            ('help', [sys.executable, '-X', 'importtime', SCRIPT_PATH, '-h']),
+            ('nothing to sync', [sys.executable, '-X', 'importtime', '-m', 'benchmarks.bench_startup', '--child',
+                                 '--api-url', server.api_url, '--playlist', PLAYLIST_ID_FRMT.format(0),
+                                 '--folder', directory]),
+        ]
+        results = dict((name, measure(command, args.runs, env)) for name, command in scenarios)
+    finally:
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print('{0:<16} {1:>10} {2:>10}  {3}'.format('scenario', 'wall ms', 'import ms', 'heavy modules loaded'))
+    for name, result in results.items():
+        print('{0:<16} {1:>10.1f} {2:>10.1f}  {3}'.format(name, result['wall_ms'], result['import_ms'],
+                                                         ', '.join(result['heavy_modules']) or '-'))
+    for name, result in results.items():
+        print('slowest imports, {0}: {1}'.format(name, ', '.join(
+            '{0} {1:.1f}ms'.format(module, cumulative / 1000.0) for module, cumulative in result['top_imports'][:args.top])))
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Compares bytes written per track when audio is tagged by mutagen after conversion
+and when tags and cover are written by ffmpeg during conversion.
+
+Linux only, written bytes are taken from /proc/self/io which includes finished ffmpeg processes.
+
+Usage: python -m benchmarks.bench_tagging [--tracks N] [--duration SECONDS] [--dir PATH]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from core import constants
+from core import converter
+from core import util
+
+
+ALBUM = 'benchmark'
+ARTIST = 'ytmp3'
+
+
+def read_io_counters():
+    counters = dict()
+    with open('/proc/self/io') as io_file:
+        for line in io_file:
+            key, _, value = line.partition(':')
+            counters[key.strip()] = int(value)
+
+    return counters
+
+
+def generate_media(directory, duration):
+    source_path = os.path.join(directory, 'source.m4a')
+    cover_path = os.path.join(directory, 'cover.jpg')
+
+    subprocess.run([constants.FFMPEG_BIN, '-y', '-loglevel', 'error', '-f', 'lavfi',
+                    '-i', 'sine=frequency=440:duration={0}'.format(duration), '-codec:a', 'aac', source_path],
+                   check=True)
+    subprocess.run([constants.FFMPEG_BIN, '-y', '-loglevel', 'error', '-f', 'lavfi',
+                    '-i', 'testsrc=size=480x360:rate=1', '-frames:v', '1', cover_path],
+                   check=True)
+
+    return source_path, cover_path
+
+
+def convert_then_tag(source_path, cover_path, output_path, track_num):
+    converter.convert_audio(source_path, output_path)
+    util.add_audio_metainfo(output_path, cover_path=cover_path, album=ALBUM, track_num=track_num,
+                            video_id='benchmark{0:02d}'.format(track_num % 100), title=str(track_num), artist=ARTIST)
+
+
+def convert_with_tags(source_path, cover_path, output_path, track_num):
+    metadata = {
+        'title': str(track_num),
+        'artist': ARTIST,
+        'album': ALBUM,
+        'track': track_num,
+        constants.VIDEO_ID_TAG: 'benchmark{0:02d}'.format(track_num % 100)
+    }
+    converter.convert_audio(source_path, output_path, metadata=metadata, cover_path=cover_path)
+
+
+def measure(name, func, directory, source_path, cover_path, tracks):
+    output_dir = os.path.join(directory, name)
+    os.makedirs(output_dir)
+
+    before = read_io_counters()
+    started = time.time()
+    for track_num in range(1, tracks + 1):
+        func(source_path, cover_path, os.path.join(output_dir, '{0}.mp3'.format(track_num)), track_num)
+    elapsed = time.time() - started
+    after = read_io_counters()
+
+    output_size = sum(os.path.getsize(os.path.join(output_dir, filename)) for filename in os.listdir(output_dir))
+
+    return {
+        'name': name,
+        'wchar': (after['wchar'] - before['wchar']) / tracks,
+        'write_bytes': (after['write_bytes'] - before['write_bytes']) / tracks,
+        'file_size': output_size / tracks,
+        'seconds': elapsed / tracks
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes written per track by two pass and single pass tagging')
+    parser.add_argument('--tracks', type=int, default=20, help='Number of tracks to convert by every method')
+    parser.add_argument('--duration', type=int, default=180, help='Duration of generated track, seconds')
+    parser.add_argument('--dir', default=None, help='Directory for generated files, should not be tmpfs')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='ytmp3_bench_', dir=args.dir)
+    try:
+        source_path, cover_path = generate_media(directory, args.duration)
+
+        results = [
+            measure('convert_then_tag', convert_then_tag, directory, source_path, cover_path, args.tracks),
+            measure('convert_with_tags', convert_with_tags, directory, source_path, cover_path, args.tracks),
+        ]
+
+        print('{0:<20} {1:>14} {2:>18} {3:>12} {4:>10}'.format('method', 'wchar/track', 'write_bytes/track',
+                                                             'size/track', 'sec/track'))
+        for result in results:
+            print('{name:<20} {wchar:>14.0f} {write_bytes:>18.0f} {file_size:>12.0f} {seconds:>10.3f}'.format(**result))
+
+        baseline = results[0]['wchar']
+        if baseline:
+            print('single pass writes {0:.1%} of two pass bytes'.format(results[1]['wchar'] / baseline))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
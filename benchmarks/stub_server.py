@@ -0,0 +1,182 @@
+"""
+Local stand-in for YouTube Data API, video pages and thumbnails, used by benchmarks.
+
+Playlist size is taken from playlist id, e.g. 'PLBENCH1000' has 1000 items. Items have video ids
+'bench000000' ... and media of every video is served by the same generated audio file.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from core import constants
+
+
+PLAYLIST_ID_FRMT = 'PLBENCH{0}'
+VIDEO_ID_FRMT = 'bench{0:06d}'
+PLAYLIST_ID_PATTERN = re.compile(r'^PLBENCH(\d+)$')
+VIDEO_ID_PATTERN = re.compile(r'^bench\d{6}$')
+
+
+def generate_media(directory, duration=30):
+    """ generates audio and thumbnail files served for every video """
+    audio_path = os.path.join(directory, 'audio.m4a')
+    thumb_path = os.path.join(directory, 'thumb.jpg')
+
+    if not os.path.exists(audio_path):
+        subprocess.run([constants.FFMPEG_BIN, '-y', '-loglevel', 'error', '-f', 'lavfi',
+                        '-i', 'sine=frequency=440:duration={0}'.format(duration), '-codec:a', 'aac', audio_path],
+                       check=True)
+    if not os.path.exists(thumb_path):
+        subprocess.run([constants.FFMPEG_BIN, '-y', '-loglevel', 'error', '-f', 'lavfi',
+                        '-i', 'testsrc=size=480x360:rate=1', '-frames:v', '1', thumb_path],
+                       check=True)
+
+    return audio_path, thumb_path
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    """ class to answer api, media and thumbnail requests """
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, nagle algorithm would delay every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = dict((key, values[0]) for key, values in parse_qs(parts.query).items())
+
+        if parts.path.endswith('/playlists'):
+            self._send_json(self._playlists(params))
+        elif parts.path.endswith('/playlistItems'):
+            self._send_json(self._playlist_items(params))
+        elif parts.path.endswith('/videos'):
+            self._send_json(self._videos(params))
+        elif parts.path.startswith('/media/') and self.server.audio_path:
+            self._send_file(self.server.audio_path, 'audio/mp4')
+        elif parts.path.startswith('/vi/') and self.server.thumb_path:
+            self._send_file(self.server.thumb_path, 'image/jpeg')
+        else:
+            self._send(404, b'', 'text/plain')
+
+    def _playlists(self, params):
+        size = _get_playlist_size(params.get('id', ''))
+        if size is None:
+            return {'pageInfo': {'totalResults': 0, 'resultsPerPage': 5}, 'items': []}
+
+        return {
+            'pageInfo': {'totalResults': 1, 'resultsPerPage': 5},
+            'items': [{'snippet': {'title': params['id'], 'channelTitle': 'benchmark'}}]
+        }
+
+    def _playlist_items(self, params):
+        size = _get_playlist_size(params.get('playlistId', '')) or 0
+        per_page = int(params.get('maxResults') or 5)
+        offset = int(params.get('pageToken') or 0)
+
+        response = {
+            'pageInfo': {'totalResults': size, 'resultsPerPage': per_page},
+            'items': [{'contentDetails': {'videoId': VIDEO_ID_FRMT.format(position)}}
+                      for position in range(offset, min(size, offset + per_page))]
+        }
+        if offset + per_page < size:
+            response['nextPageToken'] = str(offset + per_page)
+
+        return response
+
+    def _videos(self, params):
+        # every benchmark video is available, unknown ids are treated as deleted
+        return {
+            'items': [{'id': video_id,
+                       'status': {'uploadStatus': 'processed', 'privacyStatus': 'public'},
+                       'contentDetails': {'duration': 'PT{0}S'.format(self.server.duration)}}
+                      for video_id in params.get('id', '').split(',') if VIDEO_ID_PATTERN.match(video_id)]
+        }
+
+    def _send_json(self, response):
+        etag = '"{0}"'.format(hashlib.md5(json.dumps(response, sort_keys=True).encode('utf-8')).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = json.dumps(response).encode('utf-8')
+        headers = {'ETag': etag}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+
+        self._send(200, body, 'application/json', headers)
+
+    def _send_file(self, path, content_type):
+        with open(path, 'rb') as media_file:
+            self._send(200, media_file.read(), content_type)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(object):
+
+    """ class to run stub http server in background thread, media is served only if media_dir is given """
+
+    def __init__(self, media_dir=None, duration=30, port=0):
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+        self._server.daemon_threads = True
+        self._server.audio_path = self._server.thumb_path = None
+        self._server.duration = duration
+        if media_dir:
+            self._server.audio_path, self._server.thumb_path = generate_media(media_dir, duration)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-server')
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self._server.server_port)
+
+    @property
+    def api_url(self):
+        return self.url + '/youtube/v3'
+
+    @property
+    def watch_url_frmt(self):
+        return self.url + '/media/{0}.m4a'
+
+    @property
+    def thumb_url_frmt(self):
+        return self.url + '/vi/{0}/hqdefault.jpg'
+
+
+def _get_playlist_size(playlist_id):
+    match = PLAYLIST_ID_PATTERN.match(playlist_id)
+
+    return int(match.group(1)) if match else None
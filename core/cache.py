@@ -0,0 +1,67 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from . import constants
+
+
+class ResponseCache(object):
+
+    """ class to store api responses with their etags, entries are evicted by age and count """
+
+    def __init__(self, path, ttl=constants.CACHE_TTL, max_entries=constants.CACHE_MAX_ENTRIES):
+        self._path = path
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                 'key TEXT PRIMARY KEY, '
+                                 'etag TEXT, '
+                                 'body BLOB, '
+                                 'accessed_at REAL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._connection.commit()
+
+        self.evict()
+
+    def get(self, key):
+        """ returns etag and body stored for key or None """
+        with self._lock:
+            row = self._connection.execute('SELECT etag, body FROM responses WHERE key = ?', (key,)).fetchone()
+
+        return row
+
+    def put(self, key, etag, body):
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO responses (key, etag, body, accessed_at) '
+                                     'VALUES (?, ?, ?, ?)', (key, etag, body, time.time()))
+            self._connection.commit()
+
+    def touch(self, key):
+        with self._lock:
+            self._connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self._connection.commit()
+
+    def evict(self):
+        """ removes entries not used longer than ttl, then least recently used ones above max entries """
+        with self._lock:
+            expired = self._connection.execute('DELETE FROM responses WHERE accessed_at < ?',
+                                               (time.time() - self._ttl,)).rowcount
+            overflow = self._connection.execute('DELETE FROM responses WHERE key IN ('
+                                                'SELECT key FROM responses ORDER BY accessed_at DESC '
+                                                'LIMIT -1 OFFSET ?)', (self._max_entries,)).rowcount
+            self._connection.commit()
+
+        logging.debug('Response cache evicted, expired = %d, overflow = %d', expired, overflow)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
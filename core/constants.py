@@ -1,19 +1,133 @@
-from yt_dlp.utils import DateRange
-
 # general
 MAX_ATTEMPT = 5
 
+# network scheduler
+SCHEDULER_MAX_CONCURRENCY = 16
+# requests per second to a single host
+SCHEDULER_HOST_RATE = 5.0
+SCHEDULER_BASE_DELAY = 1.0
+SCHEDULER_MAX_DELAY = 60.0
+RETRYABLE_HTTP_STATUSES = [408, 429, 500, 502, 503, 504]
+# download bandwidth governor, rates are in bytes per second
+BANDWIDTH_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+# seconds of traffic which could be sent at once after idle period
+BANDWIDTH_BURST = 1.0
+# size of ranges requested when stream is downloaded in chunks
+HTTP_CHUNK_SIZE = 10 * 1024 * 1024
+
+# temp files disk budget, part of free space of temp directory used when budget is not given
+DISK_BUDGET_FREE_FRACTION = 0.5
+# size reserved for video which size is not reported by youtube-dl
+DISK_BUDGET_UNKNOWN_SIZE = 50 * 1024 * 1024
+# bits per second used to estimate audio size from video duration
+ESTIMATED_AUDIO_BITRATE = 160 * 1000
+# downloaded and converted audio are both kept until audio is saved
+DISK_BUDGET_SIZE_FACTOR = 2
+
+# distributed work queue
+QUEUE_LEASE_TIMEOUT = 10 * 60
+QUEUE_BUSY_TIMEOUT = 30
+QUEUE_POLL_INTERVAL = 5
+
+# pipeline
+DEFAULT_JOBS = 1
+PIPELINE_QUEUE_SIZE = 16
+
+# http client
+HTTP_MAX_IDLE_PER_HOST = 4
+HTTP_TIMEOUT = 30
+# google apis compress responses only when user agent contains gzip
+HTTP_USER_AGENT = 'ytmp3 (gzip)'
+
+# api response cache
+CACHE_DIR_NAME = 'ytmp3'
+CACHE_FILENAME = 'responses.db'
+CACHE_TTL = 30 * 24 * 60 * 60
+CACHE_MAX_ENTRIES = 10000
+
+# thumbnails
+THUMB_WORKERS = 4
+THUMB_CACHE_DIR_NAME = 'thumbs'
+THUMB_CACHE_MAX_BYTES = 200 * 1024 * 1024
+# eviction frees space below limit, so full cache is not scanned on every new thumbnail
+THUMB_CACHE_EVICT_FRACTION = 0.9
+
+# ffmpeg
+FFMPEG_JPEG_QUALITY = 5
+FFMPEG_BIN = 'ffmpeg'
+FFMPEG_AUDIO_CODECS = {
+    'mp3': ['-codec:a', 'libmp3lame', '-q:a', '5'],
+    'm4a': ['-codec:a', 'aac', '-b:a', '192k'],
+    'opus': ['-codec:a', 'libopus', '-b:a', '128k'],
+}
+# encoder options of every output format per profile, vbr profiles keep quality and let bitrate vary
+# quality options select vbr mode of encoders, native aac encoder takes -q:a from 0.1 to 2
+ENCODER_PROFILES = {
+    'standard': FFMPEG_AUDIO_CODECS,
+    'vbr-high': {
+        'mp3': ['-codec:a', 'libmp3lame', '-q:a', '2'],
+        'm4a': ['-codec:a', 'aac', '-q:a', '2'],
+        'opus': ['-codec:a', 'libopus', '-b:a', '160k', '-vbr', 'on'],
+    },
+    'vbr-small': {
+        'mp3': ['-codec:a', 'libmp3lame', '-q:a', '7'],
+        'm4a': ['-codec:a', 'aac', '-q:a', '0.8'],
+        'opus': ['-codec:a', 'libopus', '-b:a', '64k', '-vbr', 'on'],
+    },
+    'cbr-128': {
+        'mp3': ['-codec:a', 'libmp3lame', '-b:a', '128k'],
+        'm4a': ['-codec:a', 'aac', '-b:a', '128k'],
+        'opus': ['-codec:a', 'libopus', '-b:a', '128k', '-vbr', 'off'],
+    },
+    'cbr-320': {
+        'mp3': ['-codec:a', 'libmp3lame', '-b:a', '320k'],
+        'm4a': ['-codec:a', 'aac', '-b:a', '320k'],
+        'opus': ['-codec:a', 'libopus', '-b:a', '256k', '-vbr', 'off'],
+    },
+}
+DEFAULT_ENCODER_PROFILE = 'standard'
+# store directory of audio saved without transcoding
+STORE_COPY_PROFILE = 'copy'
+# seconds since variant was tagged before it could be removed as not linked, another process could be linking it
+STORE_CLEAN_AGE = 60 * 60
+# formats tagged by ffmpeg while converting, other formats are tagged afterwards
+FFMPEG_TAGGED_FORMATS = ['mp3']
+
+# output audio formats
+DEFAULT_AUDIO_FORMAT = 'mp3'
+OUTPUT_AUDIO_FORMATS = ['mp3', 'm4a', 'opus']
+# youtube-dl format selectors of streams which could be saved as output format without transcoding
+YTDL_COPY_FORMATS = {
+    'm4a': 'bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]',
+    'opus': 'bestaudio[acodec=opus]',
+}
+
 # supported converting audio formats
 AUDIO_FORMATS = ['aac', 'flac', 'mp3', 'm4a', 'opus', 'vorbis', 'wav']
 
 # urls
 HD_THUMB_URL_FRMT = 'http://i.ytimg.com/vi/{0}/hqdefault.jpg'
 
+# local audios index
+INDEX_FILENAME = 'ytmp3_index.db'
+# threads reading tags of new or modified files
+INDEX_SCAN_WORKERS = 8
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.opus')
+# user defined text frame holding youtube video id
+VIDEO_ID_TAG = 'YTMP3_VIDEO_ID'
+MP4_VIDEO_ID_TAG = '----:com.apple.iTunes:' + VIDEO_ID_TAG
+
 # temporary directories names
 ROOT_TEMP_DIR = 'ytmp3_tmp'
+# every queue worker process has own temp directory, workers on one host do not clean files of each other
+WORKER_TEMP_DIR_FRMT = 'ytmp3_worker_{0}'
 VIDEO_TEMP_DIR = 'video'
 AUDIO_TEMP_DIR = 'audio'
 IMAGE_TEMP_DIR = 'image'
+# journal of unfinished run, kept in root temp directory
+JOURNAL_FILENAME = 'journal.db'
+# seconds after which video failed too many times is tried again by long running service
+JOURNAL_FAILED_RETRY_AFTER = 24 * 60 * 60
 
 # ytdl output format
 YTDL_OUTP_FRMT = u"%(id)s.%(ext)s"
@@ -97,7 +211,6 @@ YTDL_OPTS = {
     'max_filesize': None,
     'min_views': None,
     'max_views': None,
-    'daterange': DateRange('00010101', '99991231'),
     'cachedir': None,
     'youtube_print_sig_code': False,
     'age_limit': None,
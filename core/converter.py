@@ -0,0 +1,84 @@
+import logging
+import os
+import subprocess
+
+from . import constants
+
+
+def convert_audio(input_path, output_path, codec='mp3', transcode=True, metadata=None, cover_path=None,
+                  stats=None, profile=constants.DEFAULT_ENCODER_PROFILE, threads=None):
+    """ converts audio with ffmpeg, without transcoding audio stream is only copied into output container
+
+    metadata and cover are written by the same ffmpeg run, so the file does not need separate tagging pass,
+    if stats dict is given, cpu time of ffmpeg process is stored in it as 'child_cpu',
+    threads limits threads of single ffmpeg process, ffmpeg decides itself if it is not given
+    """
+    if profile not in constants.ENCODER_PROFILES:
+        raise ValueError('Unknown encoder profile - {0}'.format(profile))
+    if codec not in constants.ENCODER_PROFILES[profile]:
+        raise ValueError('ffmpeg unsupported converting audio format - {0}'.format(codec))
+
+    if transcode:
+        codec_args = constants.ENCODER_PROFILES[profile][codec]
+    else:
+        codec_args = ['-codec:a', 'copy']
+
+    command = [constants.FFMPEG_BIN, '-y', '-loglevel', 'error', '-i', input_path]
+    if cover_path:
+        command += ['-i', cover_path, '-map', '0:a', '-map', '1:v', '-codec:v', 'copy',
+                    '-disposition:v', 'attached_pic',
+                    '-metadata:s:v', 'title=Album cover', '-metadata:s:v', 'comment=Cover (front)']
+    else:
+        command += ['-vn']
+    command += codec_args
+    if threads:
+        command += ['-threads', str(threads)]
+
+    if codec == 'mp3':
+        # id3v2.3 is read by more players than default id3v2.4
+        command += ['-id3v2_version', '3']
+    for key, value in sorted((metadata or {}).items()):
+        command += ['-metadata', u'{0}={1}'.format(key, value)]
+
+    command += [output_path]
+
+    logging.debug('Running ffmpeg: %s', ' '.join(command))
+
+    returncode, stderr, cpu_time = _run(command)
+    if stats is not None and cpu_time is not None:
+        stats['child_cpu'] = stats.get('child_cpu', 0.0) + cpu_time
+    if returncode != 0:
+        raise IOError(u'Audio conversion failed - {0}: {1}'.format(input_path, stderr.decode('utf-8', 'replace').strip()))
+
+    return output_path
+
+
+def _run(command):
+    """ runs command, returns exit code, stderr and cpu time of the process if platform reports it """
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    process.stderr.close()
+
+    if not hasattr(os, 'wait4'):
+        return process.wait(), stderr, None
+
+    # wait4 reports resources used by this very process, unlike getrusage shared by all children
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    return process.returncode, stderr, rusage.ru_utime + rusage.ru_stime
+
+
+def resize_image(input_path, output_path, max_width, quality=constants.FFMPEG_JPEG_QUALITY):
+    """ downscales jpeg image to max width keeping aspect ratio, smaller images are only recompressed """
+    command = [constants.FFMPEG_BIN, '-y', '-loglevel', 'error', '-i', input_path,
+               '-vf', 'scale=min(iw\\,{0}):-2'.format(max_width), '-q:v', str(quality), '-f', 'mjpeg', output_path]
+
+    logging.debug('Running ffmpeg: %s', ' '.join(command))
+
+    process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise IOError(u'Image resize failed - {0}: {1}'.format(
+            input_path, process.stderr.decode('utf-8', 'replace').strip()))
+
+    return output_path
@@ -1,21 +1,22 @@
-import logging
 import os
-from http.client import BadStatusLine
 from urllib.request import urlretrieve
 
 from .. import constants
 from .. import util
+from ..scheduler import get_bandwidth_governor
+from ..scheduler import get_scheduler
 
 
 class BaseMedia(object):
 
     """ class to represent media file """
 
-    def __init__(self, url, location):
+    def __init__(self, url, location, video_id=None):
         self._url = url
         self._location = location
         self._title = None
-        self._video_id = None
+        # parsed from url when not given
+        self._video_id = video_id
 
     def download_video(self):
         raise NotImplementedError
@@ -23,31 +24,28 @@ class BaseMedia(object):
     def download_audio(self):
         raise NotImplementedError
 
-    def download_thumb(self):
+    def download_thumb(self, thumb_cache=None):
         image_url = constants.HD_THUMB_URL_FRMT.format(self.video_id)
         thumb_ext = 'jpg'
 
         new_image_name = '{}.{}'.format(self.video_id, thumb_ext)
-
-        done = False
-        attempt = 0
-        while not done:
-            try:
-                urlretrieve(image_url, os.path.join(self.location, constants.IMAGE_TEMP_DIR, new_image_name))
-                done = True
-            except BadStatusLine as bsl:
-                attempt += 1
-                if attempt > constants.MAX_ATTEMPT:
-                    raise bsl
-                logging.info("Error while downloading thumbnail, performing {0} attempt".format(attempt))
+        thumb_path = os.path.join(self.location, constants.IMAGE_TEMP_DIR, new_image_name)
+        if thumb_cache:
+            thumb_cache.fetch(self.video_id, lambda path: self._retrieve(image_url, path), thumb_path)
+        else:
+            self._retrieve(image_url, thumb_path)
 
         res = {
             'thumb_ext': thumb_ext,
-            'thumb_filename': new_image_name
+            'thumb_filename': os.path.basename(thumb_path),
+            'thumb_path': thumb_path
         }
 
         return res
 
+    def _retrieve(self, url, path):
+        get_scheduler().call(url, urlretrieve, url, path, _consume_bandwidth)
+
     def _prepare_video_id(self):
         params = util.get_url_params(self.url)
         self._video_id = params['v']
@@ -70,3 +68,9 @@ class BaseMedia(object):
     @property
     def url(self):
         return self._url
+
+
+def _consume_bandwidth(block_num, block_size, total_size):
+    # urlretrieve report hook, it is called once before first block is read
+    if block_num:
+        get_bandwidth_governor().consume(block_size)
@@ -0,0 +1,88 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+from .. import constants
+from ..scheduler import bandwidth_progress_hook
+
+
+class YtdlSession(object):
+
+    """ class to keep long lived youtube-dl instances, every instance is used by one thread at a time
+
+    instances are pooled per options set and returned after use, so their number is bounded by number of
+    concurrent downloads even if worker threads are created again, e.g. by every watch cycle
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # options key -> idle instances
+        self._idle = dict()
+        self._instances = []
+
+    @contextmanager
+    def borrow(self, options=None):
+        """ yields youtube-dl instance created with default options updated by given ones """
+        options = options or {}
+        key = repr(sorted(options.items()))
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            ytdl = idle.pop() if idle else None
+
+        if ytdl is None:
+            ytdl = self._create(options)
+
+        try:
+            yield ytdl
+        finally:
+            with self._lock:
+                self._idle.setdefault(key, []).append(ytdl)
+
+    def close(self):
+        with self._lock:
+            instances, self._instances = self._instances, []
+            self._idle = dict()
+
+        for ytdl in instances:
+            ytdl.close()
+
+    def _create(self, options):
+        logging.debug('Creating youtube-dl instance for thread %s', threading.current_thread().name)
+
+        # youtube-dl takes most of startup time, it is imported when first video is downloaded
+        import yt_dlp
+
+        ytdl_opts = dict(constants.YTDL_OPTS)
+        ytdl_opts.update(options)
+        ytdl = yt_dlp.YoutubeDL(ytdl_opts)
+        # all downloads share bandwidth limit of the process
+        ytdl.add_progress_hook(bandwidth_progress_hook)
+
+        with self._lock:
+            self._instances.append(ytdl)
+
+        return ytdl
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def get_default_session():
+    global _default_session
+
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = YtdlSession()
+
+    return _default_session
+
+
+def close_default_session():
+    global _default_session
+
+    with _default_session_lock:
+        if _default_session is not None:
+            _default_session.close()
+            _default_session = None
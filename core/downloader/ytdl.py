@@ -1,18 +1,21 @@
 import logging
 import os
-import yt_dlp
 
 from .. import constants
 from .. import util
+from ..scheduler import get_scheduler
 from .base import BaseMedia
+from .session import get_default_session
 
 
 class YtdlMedia(BaseMedia):
 
     """ class to represent youtube-dl media file """
 
-    def __init__(self, url, location=None, **kwargs):
-        self._opts = dict(constants.YTDL_OPTS)
+    def __init__(self, url, location=None, session=None, video_id=None, **kwargs):
+        # only options which differ from defaults, instances with the same options are shared by session
+        self._opts = dict()
+        self._session = session or get_default_session()
 
         # set options to youtube-dl
         for key, value in kwargs.items():
@@ -21,18 +24,20 @@ class YtdlMedia(BaseMedia):
             # set download path with filename template youtube-dl option
             self.opts.update({'outtmpl': os.path.join(location, constants.VIDEO_TEMP_DIR, constants.YTDL_OUTP_FRMT)})
 
-        super(YtdlMedia, self).__init__(url, location)
+        super(YtdlMedia, self).__init__(url, location, video_id)
 
     def download_video(self):
-        ytdl = yt_dlp.YoutubeDL(self.opts)
-        ytdl.params.update({'format': 'best', 'quiet': False})
-        ytdl.extract_info(self.url, download=True, process=False)
+        c_opts = dict(self.opts)
+        c_opts.update({'format': 'best', 'quiet': False})
+        with self._session.borrow(c_opts) as ytdl:
+            ytdl.extract_info(self.url, download=True, process=False)
 
-    def download_audio(self, post_format=None, output_dir=None):
+    def download_audio(self, post_format=None, output_dir=None, source_format='bestaudio', before_download=None):
+        """ downloads audio, before_download is called with extracted info before media is downloaded """
         c_opts = dict(self.opts)
         # local options for audio only
         c_opts.update({
-            'format': 'bestaudio',
+            'format': source_format,
             'quiet': False
         })
 
@@ -49,10 +54,14 @@ class YtdlMedia(BaseMedia):
             else:
                 raise ValueError('youtube-dl unsupported converting audio format - {0}'.format(post_format))
 
-        ytdl = yt_dlp.YoutubeDL(c_opts)
-        ytdl_res = ytdl.extract_info(self.url, download=True, process=True)
+        with self._session.borrow(c_opts) as ytdl:
+            # formats are selected first, so size of selected streams is known before download starts
+            ytdl_res = get_scheduler().call(self.url, ytdl.extract_info, self.url, download=False, process=True)
+            if before_download:
+                before_download(ytdl_res)
+            ytdl_res = get_scheduler().call(self.url, ytdl.process_ie_result, ytdl_res, download=True)
 
-        audio_filename_full = ytdl.prepare_filename(ytdl_res)
+            audio_filename_full = ytdl.prepare_filename(ytdl_res)
 
         if post_format:
             nf_format = post_format
@@ -68,7 +77,8 @@ class YtdlMedia(BaseMedia):
             'audio_ext': nf_format,
             'audio_filename': audio_base_filename,
             'id': ytdl_res.get('display_id'),
-            'title': ytdl_res.get('title')
+            'title': ytdl_res.get('title'),
+            'artist': ytdl_res.get('artist') or ytdl_res.get('uploader')
         }
 
         logging.info(u'Audio done: {0}'.format(ytdl_res.get('title')))
@@ -78,3 +88,11 @@ class YtdlMedia(BaseMedia):
     @property
     def opts(self):
         return self._opts
+
+
+def get_estimated_size(ytdl_info):
+    """ size of selected streams reported by youtube-dl, exact or approximate, None if it is unknown """
+    sizes = [info.get('filesize') or info.get('filesize_approx')
+             for info in ytdl_info.get('requested_formats') or [ytdl_info]]
+
+    return sum(sizes) if all(sizes) else None
@@ -0,0 +1,140 @@
+import gzip
+import http.client
+import io
+import json
+import logging
+import threading
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+
+from . import constants
+
+
+# errors raised when reused keep-alive connection was already closed by server
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                            BrokenPipeError, ConnectionResetError)
+
+
+class HttpClient(object):
+
+    """ class to perform http requests over pooled keep-alive connections """
+
+    def __init__(self, max_idle_per_host=constants.HTTP_MAX_IDLE_PER_HOST, timeout=constants.HTTP_TIMEOUT):
+        self._max_idle_per_host = max_idle_per_host
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = dict()
+        self._cache = None
+
+    def request(self, url, headers=None):
+        """ performs GET request, returns status, response headers and decoded body """
+        parts = urlsplit(url)
+        host_key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        request_headers = {
+            'Accept-Encoding': 'gzip',
+            'User-Agent': constants.HTTP_USER_AGENT,
+        }
+        if headers:
+            request_headers.update(headers)
+
+        connection, reused = self._acquire(host_key)
+        try:
+            response = self._send(connection, path, request_headers)
+        except _STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused:
+                raise
+            logging.debug('Keep-alive connection to %s was closed, reconnecting', parts.netloc)
+            connection = self._connect(host_key)
+            response = self._send(connection, path, request_headers)
+        except Exception:
+            connection.close()
+            raise
+
+        body = response.read()
+        if response.getheader('Content-Encoding', '').lower() == 'gzip':
+            body = gzip.decompress(body)
+
+        response_headers = dict((key.lower(), value) for key, value in response.getheaders())
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(host_key, connection)
+
+        return response.status, response_headers, body
+
+    def get_json(self, url, headers=None, cache_key=None):
+        """ requests json, when cache is set response is revalidated with its etag """
+        logging.debug('Request to: %s', url)
+
+        headers = dict(headers or {})
+
+        cached = None
+        if self._cache is not None and cache_key:
+            cached = self._cache.get(cache_key)
+            if cached:
+                headers['If-None-Match'] = cached[0]
+
+        status, response_headers, body = self.request(url, headers)
+        if status == 304 and cached:
+            logging.debug('Response not modified, using cached one')
+            self._cache.touch(cache_key)
+            body = cached[1]
+        elif status >= 400:
+            raise HTTPError(url, status, body.decode('utf-8', 'replace'), response_headers, io.BytesIO(body))
+        elif self._cache is not None and cache_key and response_headers.get('etag'):
+            self._cache.put(cache_key, response_headers.get('etag'), body)
+
+        logging.debug('Parsing response')
+        json_response = json.loads(body.decode('utf-8'))
+
+        # serialize response only when it is really going to be printed
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug('Response as json: %s', json.dumps(json_response, indent=4))
+
+        return json_response
+
+    def set_cache(self, cache):
+        self._cache = cache
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+    def _send(self, connection, path, headers):
+        connection.request('GET', path, headers=headers)
+        return connection.getresponse()
+
+    def _acquire(self, host_key):
+        with self._lock:
+            connections = self._idle.get(host_key)
+            if connections:
+                return connections.pop(), True
+
+        return self._connect(host_key), False
+
+    def _release(self, host_key, connection):
+        with self._lock:
+            connections = self._idle.setdefault(host_key, [])
+            if len(connections) < self._max_idle_per_host:
+                connections.append(connection)
+                return
+
+        connection.close()
+
+    def _connect(self, host_key):
+        scheme, netloc = host_key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self._timeout)
+        if scheme == 'http':
+            return http.client.HTTPConnection(netloc, timeout=self._timeout)
+
+        raise ValueError('Unsupported url scheme - {0}'.format(scheme))
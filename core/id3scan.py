@@ -0,0 +1,131 @@
+import struct
+
+from . import constants
+
+
+ID3_HEADER_SIZE = 10
+FRAME_HEADER_SIZE = 10
+
+# frames needed to index audio, all other frames, e.g. cover images, are skipped without reading them
+ALBUM_FRAME = b'TALB'
+TRACK_FRAME = b'TRCK'
+USER_TEXT_FRAME = b'TXXX'
+
+# header flags
+HEADER_UNSYNCHRONISATION = 0x80
+HEADER_EXTENDED = 0x40
+
+# frame format flags which change frame data layout
+V23_FRAME_UNSUPPORTED_FLAGS = 0x00e0
+V24_FRAME_UNSUPPORTED_FLAGS = 0x000f
+
+ENCODINGS = {
+    0: ('latin-1', b'\x00'),
+    1: ('utf-16', b'\x00\x00'),
+    2: ('utf-16-be', b'\x00\x00'),
+    3: ('utf-8', b'\x00'),
+}
+
+
+def read_tags(file_path):
+    """ reads album, track number and video id from id3v2.3/2.4 tag reading only headers of other frames
+
+    returns None if tag uses features which are not supported here, e.g. unsynchronisation or compression,
+    such files should be read by mutagen
+    """
+    album = None
+    track_number = None
+    video_id = None
+
+    with open(file_path, 'rb') as audio_file:
+        header = audio_file.read(ID3_HEADER_SIZE)
+        if len(header) < ID3_HEADER_SIZE or header[:3] != b'ID3':
+            return album, track_number, video_id
+
+        major_version = header[3]
+        flags = header[5]
+        if major_version not in (3, 4) or flags & HEADER_UNSYNCHRONISATION:
+            return None
+
+        remaining = _syncsafe(header[6:10])
+
+        if flags & HEADER_EXTENDED:
+            extended_size = audio_file.read(4)
+            if major_version == 4:
+                extended_skip = _syncsafe(extended_size) - 4
+            else:
+                extended_skip = struct.unpack('>I', extended_size)[0]
+            audio_file.seek(extended_skip, 1)
+            remaining -= 4 + extended_skip
+
+        while remaining >= FRAME_HEADER_SIZE and None in (album, track_number, video_id):
+            frame_header = audio_file.read(FRAME_HEADER_SIZE)
+            if len(frame_header) < FRAME_HEADER_SIZE or frame_header[0] == 0:
+                # padding
+                break
+
+            frame_id = frame_header[:4]
+            if major_version == 4:
+                frame_size = _syncsafe(frame_header[4:8])
+            else:
+                frame_size = struct.unpack('>I', frame_header[4:8])[0]
+            frame_flags = struct.unpack('>H', frame_header[8:10])[0]
+            remaining -= FRAME_HEADER_SIZE + frame_size
+
+            if remaining < 0:
+                # broken frame size, e.g. written by encoders which ignore syncsafe integers in id3v2.4
+                return None
+
+            if frame_id not in (ALBUM_FRAME, TRACK_FRAME, USER_TEXT_FRAME):
+                audio_file.seek(frame_size, 1)
+                continue
+
+            unsupported_flags = V24_FRAME_UNSUPPORTED_FLAGS if major_version == 4 else V23_FRAME_UNSUPPORTED_FLAGS
+            if frame_flags & unsupported_flags:
+                return None
+
+            frame_data = audio_file.read(frame_size)
+            if not frame_data or frame_data[0] not in ENCODINGS:
+                continue
+
+            values = _decode_text(frame_data)
+            if frame_id == ALBUM_FRAME:
+                album = values[0]
+            elif frame_id == TRACK_FRAME:
+                track_number = values[0]
+            elif len(values) > 1 and values[0] == constants.VIDEO_ID_TAG:
+                video_id = values[1]
+
+    return album, track_number, video_id
+
+
+def _syncsafe(data):
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7f)
+
+    return value
+
+
+def _decode_text(frame_data):
+    encoding, terminator = ENCODINGS[frame_data[0]]
+    data = frame_data[1:]
+
+    # split by terminators aligned to character size, utf-16 characters could contain zero byte
+    values = []
+    start = 0
+    position = data.find(terminator)
+    while position != -1:
+        if (position - start) % len(terminator) == 0:
+            values.append(data[start:position])
+            start = position + len(terminator)
+            position = data.find(terminator, start)
+        else:
+            position = data.find(terminator, position + 1)
+    values.append(data[start:])
+
+    values = [value.decode(encoding, 'replace') for value in values]
+    while len(values) > 1 and not values[-1]:
+        values.pop()
+
+    return values or ['']
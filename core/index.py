@@ -0,0 +1,199 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import constants
+from . import id3scan
+
+
+VIDEO_ID_PATTERN = re.compile(r'\[([A-Za-z0-9_-]{11})\]$')
+
+# opened indexes, one per working directory
+_indexes = dict()
+_indexes_lock = threading.Lock()
+
+
+class LocalIndex(object):
+
+    """ class to keep info about local audios between runs, files are re-read only when changed """
+
+    def __init__(self, working_dir):
+        self._working_dir = working_dir
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(working_dir, constants.INDEX_FILENAME),
+                                           check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS audios ('
+                                 'filename TEXT PRIMARY KEY, '
+                                 'video_id TEXT, '
+                                 'album TEXT, '
+                                 'track_num INTEGER, '
+                                 'size INTEGER, '
+                                 'mtime INTEGER)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS audios_video_id ON audios (video_id)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS audios_album ON audios (album, track_num)')
+        self._connection.commit()
+
+    def refresh(self):
+        """ brings index in line with working directory, only new or modified files are parsed """
+        logging.info("Refreshing local audios index for '%s'", self._working_dir)
+
+        with self._lock:
+            known = dict()
+            for filename, size, mtime in self._connection.execute('SELECT filename, size, mtime FROM audios'):
+                known[filename] = (size, mtime)
+
+            present = set()
+            changed = []
+            for entry in os.scandir(self._working_dir):
+                if not entry.is_file() or not entry.name.endswith(constants.AUDIO_EXTENSIONS):
+                    continue
+
+                present.add(entry.name)
+
+                stat = entry.stat()
+                if known.get(entry.name) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append((entry, stat))
+
+            # reading tags is mostly waiting for disk, files are read in parallel
+            with ThreadPoolExecutor(max_workers=constants.INDEX_SCAN_WORKERS) as executor:
+                all_tags = executor.map(read_audio_tags, [entry.path for entry, _ in changed])
+                for (entry, stat), (album, track_num, tag_video_id) in zip(changed, all_tags):
+                    self._upsert(entry.name, get_video_id(entry.name) or tag_video_id, album, track_num, stat)
+            updated = len(changed)
+
+            removed = set(known) - present
+            self._connection.executemany('DELETE FROM audios WHERE filename = ?',
+                                         [(filename,) for filename in removed])
+            self._connection.commit()
+
+        logging.debug('Local audios index refreshed, total = %d, updated = %d, removed = %d',
+                      len(present), updated, len(removed))
+
+    def add(self, filename, video_id=None, album=None, track_num=None):
+        stat = os.stat(os.path.join(self._working_dir, filename))
+
+        with self._lock:
+            self._upsert(filename, video_id or get_video_id(filename), album, track_num, stat)
+            self._connection.commit()
+
+    def video_ids(self):
+        with self._lock:
+            return set(row[0] for row in self._connection.execute('SELECT video_id FROM audios '
+                                                                  'WHERE video_id IS NOT NULL'))
+
+    def get_last_track_number(self, album):
+        with self._lock:
+            row = self._connection.execute('SELECT MAX(track_num) FROM audios WHERE album = ?', (album,)).fetchone()
+
+        return row[0] or 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _upsert(self, filename, video_id, album, track_num, stat):
+        self._connection.execute('INSERT OR REPLACE INTO audios (filename, video_id, album, track_num, size, mtime) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)',
+                                 (filename, video_id, album, track_num, stat.st_size, stat.st_mtime_ns))
+
+
+def get_index(working_dir):
+    """ returns index of working directory, refreshed once per process """
+    working_dir = os.path.abspath(working_dir)
+
+    with _indexes_lock:
+        local_index = _indexes.get(working_dir)
+        if local_index is None:
+            local_index = LocalIndex(working_dir)
+            local_index.refresh()
+            _indexes[working_dir] = local_index
+
+    return local_index
+
+
+def refresh_indexes():
+    """ refreshes all opened indexes, used by long running process to notice files changed by others """
+    with _indexes_lock:
+        local_indexes = list(_indexes.values())
+
+    for local_index in local_indexes:
+        local_index.refresh()
+
+
+def close_indexes():
+    with _indexes_lock:
+        for local_index in _indexes.values():
+            local_index.close()
+        _indexes.clear()
+
+
+def get_video_id(filename):
+    title, _, _ = filename.rpartition('.')
+    match = VIDEO_ID_PATTERN.search(title)
+
+    return match.group(1) if match else None
+
+
+def read_audio_tags(file_path):
+    if file_path.lower().endswith('.mp3'):
+        try:
+            tags = id3scan.read_tags(file_path)
+        except Exception as ex:
+            logging.debug('Could not scan id3 tag of "%s" - %s', file_path, str(ex))
+            tags = None
+
+        if tags is not None:
+            album, track_number, video_id = tags
+            return album, parse_track_number(track_number), video_id
+
+    # mutagen is needed only for files scanner could not read
+    import mutagen
+    import mutagen.id3
+    import mutagen.mp4
+
+    album = None
+    track_number = None
+    video_id = None
+
+    try:
+        info = mutagen.File(file_path)
+    except Exception as ex:
+        logging.debug('Could not read tags from "%s" - %s', file_path, str(ex))
+        return album, track_number, video_id
+
+    if info is None or info.tags is None:
+        return album, track_number, video_id
+
+    if isinstance(info.tags, mutagen.id3.ID3):
+        mutagen_audio_album = info.tags.get('TALB')
+        mutagen_track_number = info.tags.get('TRCK')
+        mutagen_video_id = info.tags.get('TXXX:' + constants.VIDEO_ID_TAG)
+
+        album = mutagen_audio_album.text[0] if mutagen_audio_album else None
+        track_number = mutagen_track_number.text[0] if mutagen_track_number else None
+        video_id = mutagen_video_id.text[0] if mutagen_video_id else None
+    elif isinstance(info.tags, mutagen.mp4.MP4Tags):
+        album = info.tags.get('\xa9alb', [None])[0]
+        track_number = info.tags.get('trkn', [(None, None)])[0][0]
+        mutagen_video_id = info.tags.get(constants.MP4_VIDEO_ID_TAG)
+        video_id = bytes(mutagen_video_id[0]).decode('utf-8') if mutagen_video_id else None
+    else:
+        album = info.tags.get('album', [None])[0]
+        track_number = info.tags.get('tracknumber', [None])[0]
+        video_id = info.tags.get(constants.VIDEO_ID_TAG.lower(), [None])[0]
+
+    return album, parse_track_number(track_number), video_id
+
+
+def parse_track_number(track_number):
+    """ parses track number, e.g. '3' or '3/12' """
+    try:
+        if track_number:
+            return int(str(track_number).partition('/')[0])
+    except ValueError:
+        logging.debug('Track number error, must be integer, current value is "%s"', track_number)
+
+    return None
@@ -0,0 +1,123 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from . import constants
+
+
+# stages in order of completion
+STAGE_QUEUED = 'queued'
+STAGE_DOWNLOADED = 'downloaded'
+STAGE_CONVERTED = 'converted'
+STAGE_TAGGED = 'tagged'
+
+STAGES = [STAGE_QUEUED, STAGE_DOWNLOADED, STAGE_CONVERTED, STAGE_TAGGED]
+# video which failed too many times, it is not retried until journal is pruned
+STAGE_FAILED = 'failed'
+
+
+class JobJournal(object):
+
+    """ class to record stage of every video, so interrupted run could be resumed """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                                 'video_id TEXT PRIMARY KEY, '
+                                 'position INTEGER, '
+                                 'stage TEXT, '
+                                 'task TEXT, '
+                                 'attempts INTEGER DEFAULT 0, '
+                                 'failed_at REAL)')
+        # journal could be left by interrupted run of older version
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(jobs)')]
+        if 'attempts' not in columns:
+            self._connection.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0')
+            self._connection.execute('ALTER TABLE jobs ADD COLUMN failed_at REAL')
+        self._connection.commit()
+
+    def queue(self, video_id, task):
+        """ records new task, task which is already in journal keeps its stage """
+        with self._lock:
+            self._connection.execute('INSERT OR IGNORE INTO jobs (video_id, position, stage, task) '
+                                     'VALUES (?, (SELECT COUNT(*) FROM jobs), ?, ?)',
+                                     (video_id, STAGE_QUEUED, json.dumps(task)))
+            self._connection.commit()
+
+    def update(self, video_id, task, stage):
+        """ stores task with all results collected so far as completed up to stage """
+        with self._lock:
+            self._connection.execute('UPDATE jobs SET stage = ?, task = ? WHERE video_id = ?',
+                                     (stage, json.dumps(task), video_id))
+            self._connection.commit()
+
+    def fail(self, video_id, max_attempts=constants.MAX_ATTEMPT):
+        """ counts failed attempt, returns True if video failed max_attempts times and is not retried anymore """
+        with self._lock:
+            self._connection.execute('UPDATE jobs SET attempts = attempts + 1, '
+                                     'stage = CASE WHEN attempts + 1 >= ? THEN ? ELSE stage END, '
+                                     'failed_at = ? WHERE video_id = ?',
+                                     (max_attempts, STAGE_FAILED, time.time(), video_id))
+            self._connection.commit()
+            row = self._connection.execute('SELECT stage FROM jobs WHERE video_id = ?', (video_id,)).fetchone()
+
+        return row is not None and row[0] == STAGE_FAILED
+
+    def failed_ids(self):
+        with self._lock:
+            rows = self._connection.execute('SELECT video_id FROM jobs WHERE stage = ?', (STAGE_FAILED,)).fetchall()
+
+        return set(row[0] for row in rows)
+
+    def prune(self, failed_age=constants.JOURNAL_FAILED_RETRY_AFTER):
+        """ removes saved videos and videos failed longer than failed_age ago, so they are retried """
+        with self._lock:
+            tagged = self._connection.execute('DELETE FROM jobs WHERE stage = ?', (STAGE_TAGGED,)).rowcount
+            failed = self._connection.execute('DELETE FROM jobs WHERE stage = ? AND failed_at < ?',
+                                              (STAGE_FAILED, time.time() - failed_age)).rowcount
+            self._connection.commit()
+
+        return tagged, failed
+
+    def get(self, video_id):
+        """ returns completed stage and task stored for video or None, None """
+        with self._lock:
+            row = self._connection.execute('SELECT stage, task FROM jobs WHERE video_id = ?', (video_id,)).fetchone()
+
+        if row is None:
+            return None, None
+
+        return row[0], json.loads(row[1])
+
+    def pending_tasks(self):
+        """ returns tasks which were not finished by previous run, in order they were queued """
+        with self._lock:
+            rows = self._connection.execute('SELECT task FROM jobs WHERE stage NOT IN (?, ?) ORDER BY position',
+                                            (STAGE_TAGGED, STAGE_FAILED)).fetchall()
+
+        return [json.loads(row[0]) for row in rows]
+
+    def get_last_track_number(self, working_dir, album):
+        max_track_number = 0
+        for task in self.pending_tasks():
+            for target in task.get('targets', []):
+                if target['working_dir'] == working_dir and target['album'] == album:
+                    max_track_number = max(max_track_number, target['track_num'] or 0)
+
+        return max_track_number
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def is_completed(stage, required_stage):
+    return stage in STAGES and STAGES.index(stage) >= STAGES.index(required_stage)
+
+
+def get_journal_path(temp_root):
+    return os.path.join(temp_root, constants.ROOT_TEMP_DIR, constants.JOURNAL_FILENAME)
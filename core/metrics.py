@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class RunMetrics(object):
+
+    """ class to collect timings of every stage per video and build run report """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._finished = None
+        # stage name -> list of measurements
+        self._stages = OrderedDict()
+        # video id -> stage name where it failed
+        self._failures = dict()
+
+    @contextmanager
+    def measure(self, stage, video_id=None):
+        """ measures wall and thread cpu time of the block, block could add own values, e.g. bytes
+
+        block could also report child_cpu added to cpu time and idle_wall excluded from wall time, e.g. time
+        spent waiting for another stage measured separately
+        """
+        values = dict()
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            yield values
+        finally:
+            values['wall'] = time.perf_counter() - started - values.pop('idle_wall', 0.0)
+            values['cpu'] = time.thread_time() - cpu_started + values.pop('child_cpu', 0.0)
+            if values.get('bytes') and values['wall'] > 0:
+                values['rate'] = values['bytes'] / values['wall']
+            self.record(stage, video_id, **values)
+
+    def record(self, stage, video_id=None, **values):
+        values['video_id'] = video_id
+        with self._lock:
+            self._stages.setdefault(stage, []).append(values)
+
+    def record_failure(self, stage, video_id):
+        with self._lock:
+            self._failures[video_id] = stage
+
+    def finish(self):
+        self._finished = time.time()
+
+    def reset(self):
+        """ drops all measurements and starts new run, e.g. next synchronization of long running service """
+        with self._lock:
+            self._started = time.time()
+            self._finished = None
+            self._stages = OrderedDict()
+            self._failures = dict()
+
+    def report(self):
+        with self._lock:
+            stages = OrderedDict((stage, list(measurements)) for stage, measurements in self._stages.items())
+            failures = dict(self._failures)
+
+        finished = self._finished or time.time()
+
+        stage_reports = OrderedDict()
+        videos = OrderedDict()
+        for stage, measurements in stages.items():
+            stage_report = OrderedDict()
+            stage_report['count'] = len(measurements)
+            for key in ('wall', 'cpu', 'bytes', 'rate'):
+                stage_values = [measurement[key] for measurement in measurements if measurement.get(key) is not None]
+                if stage_values:
+                    stage_report[key] = summarize(stage_values)
+            stage_reports[stage] = stage_report
+
+            for measurement in measurements:
+                if measurement['video_id'] is None:
+                    continue
+                video_stages = videos.setdefault(measurement['video_id'], OrderedDict())
+                video_stages[stage] = dict((key, value) for key, value in measurement.items() if key != 'video_id')
+
+        return OrderedDict([
+            ('started', self._started),
+            ('finished', finished),
+            ('duration', finished - self._started),
+            ('failed', failures),
+            ('stages', stage_reports),
+            ('videos', videos),
+        ])
+
+    def log_summary(self):
+        for stage, stage_report in self.report()['stages'].items():
+            wall = stage_report.get('wall', {})
+            logging.info('Stage %s: count = %d, p50 = %.2fs, p95 = %.2fs, total = %.2fs', stage,
+                         stage_report['count'], wall.get('p50', 0), wall.get('p95', 0), wall.get('total', 0))
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.report(), indent=4))
+
+        logging.info('Run report saved to "%s"', path)
+
+    def write_prometheus(self, path):
+        report = self.report()
+
+        lines = [
+            '# HELP ytmp3_run_duration_seconds Duration of the whole run.',
+            '# TYPE ytmp3_run_duration_seconds gauge',
+            'ytmp3_run_duration_seconds {0}'.format(report['duration']),
+            '# HELP ytmp3_stage_seconds Wall time of a stage per video.',
+            '# TYPE ytmp3_stage_seconds summary',
+        ]
+        for stage, stage_report in report['stages'].items():
+            wall = stage_report.get('wall')
+            if not wall:
+                continue
+            lines += [
+                'ytmp3_stage_seconds{{stage="{0}",quantile="0.5"}} {1}'.format(stage, wall['p50']),
+                'ytmp3_stage_seconds{{stage="{0}",quantile="0.95"}} {1}'.format(stage, wall['p95']),
+                'ytmp3_stage_seconds_sum{{stage="{0}"}} {1}'.format(stage, wall['total']),
+                'ytmp3_stage_seconds_count{{stage="{0}"}} {1}'.format(stage, stage_report['count']),
+            ]
+
+        lines += [
+            '# HELP ytmp3_stage_cpu_seconds_total CPU time of a stage, including ffmpeg processes.',
+            '# TYPE ytmp3_stage_cpu_seconds_total counter',
+        ]
+        for stage, stage_report in report['stages'].items():
+            if stage_report.get('cpu'):
+                lines.append('ytmp3_stage_cpu_seconds_total{{stage="{0}"}} {1}'.format(
+                    stage, stage_report['cpu']['total']))
+
+        lines += [
+            '# HELP ytmp3_stage_bytes_total Bytes processed by a stage.',
+            '# TYPE ytmp3_stage_bytes_total counter',
+        ]
+        for stage, stage_report in report['stages'].items():
+            if stage_report.get('bytes'):
+                lines.append('ytmp3_stage_bytes_total{{stage="{0}"}} {1}'.format(
+                    stage, stage_report['bytes']['total']))
+
+        lines += [
+            '# HELP ytmp3_failed_videos Number of videos which failed.',
+            '# TYPE ytmp3_failed_videos gauge',
+            'ytmp3_failed_videos {0}'.format(len(report['failed'])),
+        ]
+
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+        logging.info('Prometheus metrics saved to "%s"', path)
+
+
+def percentile(sorted_values, fraction):
+    """ nearest rank percentile of already sorted values """
+    if not sorted_values:
+        return None
+
+    rank = max(1, int(-(-fraction * len(sorted_values) // 1)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(values):
+    sorted_values = sorted(values)
+
+    return OrderedDict([
+        ('total', sum(sorted_values)),
+        ('min', sorted_values[0]),
+        ('p50', percentile(sorted_values, 0.5)),
+        ('p95', percentile(sorted_values, 0.95)),
+        ('max', sorted_values[-1]),
+    ])
+
+
+def _write_atomic(path, content):
+    # readers, e.g. node exporter, never see partially written file
+    partial_path = path + '.part'
+    with open(partial_path, 'w', encoding='utf-8') as output_file:
+        output_file.write(content)
+    os.replace(partial_path, path)
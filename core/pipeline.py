@@ -0,0 +1,130 @@
+import logging
+import queue
+import threading
+
+from . import constants
+
+
+# marker put into stage queue to stop its workers
+_STOP = object()
+
+
+class Stage(object):
+
+    """ class to represent single pipeline stage with its own pool of workers """
+
+    def __init__(self, name, func, workers=1):
+        if workers < 1:
+            raise ValueError('Stage must have at least one worker - {0}'.format(name))
+
+        self._name = name
+        self._func = func
+        self._workers = workers
+
+    def process(self, task):
+        return self._func(task)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def workers(self):
+        return self._workers
+
+
+class Pipeline(object):
+
+    """ class to pass tasks through stages, every stage reads from its own bounded queue """
+
+    def __init__(self, stages, queue_size=None, on_done=None, on_error=None):
+        if not stages:
+            raise ValueError('Pipeline must have at least one stage')
+
+        self._stages = stages
+        self._queue_size = queue_size or constants.PIPELINE_QUEUE_SIZE
+        self._on_done = on_done
+        self._on_error = on_error
+
+        self._lock = threading.Lock()
+        self._done = []
+        self._failed = []
+
+    def run(self, tasks):
+        """ feeds tasks in order and blocks until all of them passed or failed every stage """
+        queues = [queue.Queue(maxsize=self._queue_size) for _ in self._stages]
+        running = [stage.workers for stage in self._stages]
+
+        threads = []
+        for index, stage in enumerate(self._stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(index, queues, running),
+                                          name='{0}-{1}'.format(stage.name, worker))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+        logging.debug('Pipeline started, stages - %s',
+                      ', '.join('{0} x{1}'.format(stage.name, stage.workers) for stage in self._stages))
+
+        try:
+            for task in tasks:
+                queues[0].put(task)
+        finally:
+            for _ in range(self._stages[0].workers):
+                queues[0].put(_STOP)
+            for thread in threads:
+                thread.join()
+
+        return self._done, self._failed
+
+    def _work(self, index, queues, running):
+        stage = self._stages[index]
+        is_last = index == len(self._stages) - 1
+
+        while True:
+            task = queues[index].get()
+            if task is _STOP:
+                break
+
+            try:
+                task = stage.process(task)
+            except Exception as ex:
+                self._fail(stage, task, ex)
+                continue
+
+            if is_last:
+                self._finish(task)
+            else:
+                queues[index + 1].put(task)
+
+        # last worker of the stage stops workers of the next one
+        with self._lock:
+            running[index] -= 1
+            stage_finished = running[index] == 0
+        if stage_finished and not is_last:
+            for _ in range(self._stages[index + 1].workers):
+                queues[index + 1].put(_STOP)
+
+    def _finish(self, task):
+        with self._lock:
+            self._done.append(task)
+        if self._on_done:
+            try:
+                self._on_done(task)
+            except Exception as ex:
+                logging.error('An error occurred in pipeline done callback')
+                logging.exception(ex)
+
+    def _fail(self, stage, task, ex):
+        with self._lock:
+            self._failed.append(task)
+        if self._on_error:
+            try:
+                self._on_error(stage.name, task, ex)
+                return
+            except Exception as callback_ex:
+                logging.error('An error occurred in pipeline error callback')
+                logging.exception(callback_ex)
+        logging.error('An error occurred at pipeline stage "%s". Skipping task', stage.name)
+        logging.exception(ex)
@@ -0,0 +1,308 @@
+import http.client
+import logging
+import random
+import re
+import socket
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.error import URLError
+from urllib.parse import urlsplit
+
+from . import constants
+
+
+class TokenBucket(object):
+
+    """ class to limit rate of operations, tokens are refilled continuously up to capacity """
+
+    def __init__(self, rate, capacity=None):
+        self._rate = float(rate)
+        self._capacity = float(capacity or max(rate, 1))
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, tokens=1):
+        """ blocks until requested amount of tokens is available """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+
+                # requests bigger than capacity are let through once bucket is full
+                if self._tokens >= min(tokens, self._capacity):
+                    self._tokens -= tokens
+                    return
+                wait = (min(tokens, self._capacity) - self._tokens) / self._rate
+
+            time.sleep(wait)
+
+    @property
+    def rate(self):
+        return self._rate
+
+
+class DiskBudget(object):
+
+    """ class to limit bytes of temp files of videos in progress, every video reserves its estimated size """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._condition = threading.Condition()
+        # key -> reserved bytes
+        self._reserved = dict()
+        self._in_flight = 0
+
+    def acquire(self, key, size):
+        """ blocks until size fits into budget, item bigger than whole budget waits until nothing is in flight """
+        with self._condition:
+            while self._in_flight and self._in_flight + size > self._max_bytes:
+                self._condition.wait()
+
+            self._reserved[key] = self._reserved.get(key, 0) + size
+            self._in_flight += size
+
+    def release(self, key):
+        """ frees everything reserved by key, unknown keys are ignored """
+        with self._condition:
+            size = self._reserved.pop(key, 0)
+            if size:
+                self._in_flight -= size
+                self._condition.notify_all()
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @property
+    def in_flight(self):
+        with self._condition:
+            return self._in_flight
+
+
+class BandwidthGovernor(object):
+
+    """ class to limit download rate of the whole process, rate could depend on time of day
+
+    schedule is list of (start minute, end minute, rate) windows of local time, window could pass midnight,
+    default rate is used outside of windows, rate None means unlimited
+    """
+
+    def __init__(self, rate=None, schedule=None):
+        self._rate = rate
+        self._schedule = schedule or []
+        self._lock = threading.Lock()
+        self._bucket = None
+        # download file name -> bytes reported by last progress hook call
+        self._downloaded = dict()
+
+    def get_rate(self, now=None):
+        local_time = time.localtime(now)
+        minute = local_time.tm_hour * 60 + local_time.tm_min
+        for start, end, rate in self._schedule:
+            if start <= minute < end or start > end and (minute >= start or minute < end):
+                return rate
+
+        return self._rate
+
+    def consume(self, size):
+        """ blocks until size bytes could be received without exceeding current rate """
+        rate = self.get_rate()
+        if not rate or size <= 0:
+            return
+
+        with self._lock:
+            # bucket is replaced when schedule window changes
+            if self._bucket is None or self._bucket.rate != rate:
+                self._bucket = TokenBucket(rate, rate * constants.BANDWIDTH_BURST)
+            bucket = self._bucket
+
+        bucket.consume(size)
+
+    def progress_hook(self, status):
+        """ youtube-dl progress hook, sleeps in downloading thread until received bytes fit into rate """
+        filename = status.get('filename')
+        if status.get('status') != 'downloading':
+            with self._lock:
+                self._downloaded.pop(filename, None)
+            return
+
+        downloaded = status.get('downloaded_bytes') or 0
+        with self._lock:
+            # first report is baseline, resumed download reports bytes of partial file which are not received now
+            previous = self._downloaded.get(filename, downloaded)
+            self._downloaded[filename] = downloaded
+        size = downloaded - previous
+
+        self.consume(size)
+
+
+class NetworkScheduler(object):
+
+    """ class to run network calls with global concurrency cap, per host rate limit and retries with backoff """
+
+    def __init__(self, max_concurrency=constants.SCHEDULER_MAX_CONCURRENCY, host_rate=constants.SCHEDULER_HOST_RATE,
+                 max_attempts=constants.MAX_ATTEMPT, base_delay=constants.SCHEDULER_BASE_DELAY,
+                 max_delay=constants.SCHEDULER_MAX_DELAY):
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._host_rate = host_rate
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._lock = threading.Lock()
+        self._buckets = dict()
+
+    def call(self, url, func, *args, **kwargs):
+        """ calls func, retries it when it failed with transient network error """
+        host = urlsplit(url).netloc or url
+        bucket = self._get_bucket(host)
+
+        attempt = 0
+        while True:
+            bucket.consume()
+            with self._semaphore:
+                try:
+                    return func(*args, **kwargs)
+                except Exception as ex:
+                    attempt += 1
+                    if attempt >= self._max_attempts or not is_retryable(ex):
+                        raise
+                    delay = get_retry_after(ex)
+
+            if delay is None:
+                # exponential backoff with full jitter
+                delay = random.uniform(0, min(self._max_delay, self._base_delay * 2 ** attempt))
+
+            logging.info('Network error while requesting %s, performing %d attempt in %.1f seconds',
+                         host, attempt + 1, delay)
+            time.sleep(delay)
+
+    def _get_bucket(self, host):
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self._host_rate)
+
+        return bucket
+
+
+def _get_cause(ex):
+    # youtube-dl wraps original errors into its own ones
+    exc_info = getattr(ex, 'exc_info', None)
+    if exc_info and len(exc_info) > 1 and isinstance(exc_info[1], BaseException) and exc_info[1] is not ex:
+        return exc_info[1]
+
+    cause = getattr(ex, 'cause', None)
+    if isinstance(cause, BaseException) and cause is not ex:
+        return cause
+
+    return None
+
+
+def _get_status(ex):
+    status = getattr(ex, 'code', None)
+    if not isinstance(status, int):
+        status = getattr(ex, 'status', None)
+
+    return status if isinstance(status, int) else None
+
+
+def parse_rate(value):
+    """ parses rate like '500K' or '2M', bytes per second, zero means unlimited """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)\s*$', value, re.IGNORECASE)
+    if not match:
+        raise ValueError('invalid rate - {0}'.format(value))
+
+    rate = float(match.group(1)) * constants.BANDWIDTH_UNITS[match.group(2).upper()]
+
+    return rate or None
+
+
+def parse_bandwidth_schedule(value):
+    """ parses comma separated windows like '09:00-18:00=2M', returns list of (start, end, rate) in minutes """
+    schedule = []
+    for window in value.split(','):
+        match = re.match(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=(.+)$', window)
+        if not match:
+            raise ValueError('invalid schedule window - {0}'.format(window))
+
+        start_hour, start_minute, end_hour, end_minute = [int(group) for group in match.groups()[:4]]
+        if start_minute > 59 or end_minute > 59 or max(start_hour * 60 + start_minute, end_hour * 60 + end_minute) > 24 * 60:
+            raise ValueError('invalid schedule window - {0}'.format(window))
+        schedule.append((start_hour * 60 + start_minute, end_hour * 60 + end_minute, parse_rate(match.group(5))))
+
+    return schedule
+
+
+def is_retryable(ex):
+    while ex is not None:
+        status = _get_status(ex)
+        if status is not None:
+            return status in constants.RETRYABLE_HTTP_STATUSES
+        if isinstance(ex, HTTPError):
+            return False
+        if isinstance(ex, (URLError, http.client.HTTPException, ConnectionError, socket.timeout, TimeoutError)):
+            return True
+        ex = _get_cause(ex)
+
+    return False
+
+
+def get_retry_after(ex):
+    while ex is not None:
+        headers = getattr(ex, 'headers', None)
+        if headers is not None:
+            try:
+                retry_after = headers.get('Retry-After') or headers.get('retry-after')
+                if retry_after is not None:
+                    return min(float(retry_after), constants.SCHEDULER_MAX_DELAY)
+            except (AttributeError, ValueError):
+                pass
+        ex = _get_cause(ex)
+
+    return None
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _default_scheduler
+
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = NetworkScheduler()
+
+    return _default_scheduler
+
+
+def configure_scheduler(**kwargs):
+    global _default_scheduler
+
+    with _default_scheduler_lock:
+        _default_scheduler = NetworkScheduler(**kwargs)
+
+    return _default_scheduler
+
+
+_bandwidth_governor = BandwidthGovernor()
+
+
+def get_bandwidth_governor():
+    return _bandwidth_governor
+
+
+def configure_bandwidth(rate=None, schedule=None):
+    global _bandwidth_governor
+
+    _bandwidth_governor = BandwidthGovernor(rate, schedule)
+
+    return _bandwidth_governor
+
+
+def bandwidth_progress_hook(status):
+    """ progress hook of long lived youtube-dl instances, governor could be configured after they are created """
+    _bandwidth_governor.progress_hook(status)
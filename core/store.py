@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from . import constants
+from . import util
+
+
+class MediaStore(object):
+
+    """ class to keep converted audio once per video and encoder profile, shared by many working directories
+
+    every album and track number combination gets its own copy tagged once, working directories get hard links
+    to these copies; base file has only tags which do not depend on album, it is removed when the first copy is
+    made, next copies are made from existing ones; files of every video are kept in its own directory
+    """
+
+    def __init__(self, directory, profile, audio_format):
+        self._directory = os.path.join(directory, profile)
+        self._audio_format = audio_format
+        self._lock = threading.Lock()
+        self._variant_pattern = re.compile(r'^.+\.[0-9a-f]{{12}}\.{0}$'.format(re.escape(audio_format)))
+
+        if not os.path.exists(self._directory):
+            os.makedirs(self._directory)
+
+    def get_path(self, video_id):
+        return os.path.join(self._get_video_dir(video_id), '{0}.{1}'.format(video_id, self._audio_format))
+
+    def get_variant_path(self, video_id, album, track_num):
+        tags_hash = hashlib.sha1(json.dumps([album, track_num]).encode('utf-8')).hexdigest()[:12]
+
+        return os.path.join(self._get_video_dir(video_id),
+                            '{0}.{1}.{2}'.format(video_id, tags_hash, self._audio_format))
+
+    def get_source_path(self, video_id):
+        """ returns base file of video or any of its copies, None if nothing is stored """
+        path = self.get_path(video_id)
+        if os.path.exists(path):
+            return path
+
+        variant_paths = self._get_variant_paths(video_id)
+
+        return variant_paths[0] if variant_paths else None
+
+    def get_info(self, video_id):
+        """ returns info of stored video, e.g. title and artist, None if video is not stored """
+        info_path = self._get_info_path(video_id)
+        source_path = self.get_source_path(video_id)
+        if not os.path.exists(info_path) or not source_path:
+            return None
+
+        with open(info_path, encoding='utf-8') as info_file:
+            info = json.load(info_file)
+        info['audio_path'] = source_path
+
+        return info
+
+    def put(self, video_id, audio_path, info, fsync=False):
+        """ moves converted audio into store, audio must not have album and track number tags """
+        video_dir = self._get_video_dir(video_id)
+        if not os.path.exists(video_dir):
+            os.makedirs(video_dir, exist_ok=True)
+
+        path = self.get_path(video_id)
+        util.move(audio_path, path, fsync=fsync)
+
+        info = dict((key, info.get(key)) for key in ('id', 'title', 'artist', 'audio_ext'))
+        info_path = self._get_info_path(video_id)
+        partial_path = '{0}.{1}.{2}.part'.format(info_path, os.getpid(), threading.get_ident())
+        with open(partial_path, 'w', encoding='utf-8') as info_file:
+            json.dump(info, info_file)
+        os.replace(partial_path, info_path)
+
+        logging.debug('Audio saved into store - %s', video_id)
+
+        return path
+
+    def get_variant(self, video_id, album, track_num, staging_dir, fsync=False):
+        """ returns stored audio tagged with album and track number, copy is tagged when it is first needed
+
+        store could be shared by several processes, so source file stays in store until the copy is in place
+        """
+        variant_path = self.get_variant_path(video_id, album, track_num)
+        with self._lock:
+            if os.path.exists(variant_path):
+                return variant_path
+
+            # tagged in staging directory, store has either complete copy or none
+            staged_path = os.path.join(staging_dir, os.path.basename(variant_path))
+            for attempt in range(constants.MAX_ATTEMPT):
+                info = self.get_info(video_id)
+                if info is None:
+                    raise IOError('Audio is not found in store - {0}'.format(video_id))
+                try:
+                    util.copy(info['audio_path'], staged_path)
+                    break
+                except (IOError, OSError):
+                    # base file was removed by another process which made the first copy meanwhile
+                    if attempt == constants.MAX_ATTEMPT - 1:
+                        raise
+
+            util.remove_album_tags(staged_path)
+            util.add_audio_metainfo(staged_path, album=album, track_num=track_num, video_id=video_id,
+                                    title=info.get('title'), artist=info.get('artist'))
+            util.move(staged_path, variant_path, fsync=fsync)
+
+            # base file is not linked anywhere, it is not kept next to copies
+            if info['audio_path'] == self.get_path(video_id):
+                try:
+                    os.remove(info['audio_path'])
+                except OSError:
+                    pass
+
+        return variant_path
+
+    def clean(self, min_age=constants.STORE_CLEAN_AGE):
+        """ removes copies which are not linked into any working directory anymore
+
+        one file of every video is kept to make new copies, copies younger than min_age are kept, another
+        process could be linking them
+        """
+        removed = 0
+        with self._lock:
+            now = time.time()
+            for entry in os.scandir(self._directory):
+                if not entry.is_dir():
+                    continue
+
+                video_id = entry.name
+                variant_paths = self._get_variant_paths(video_id)
+                unused_paths = [path for path in variant_paths if _is_unused(path, now - min_age)]
+                if len(unused_paths) == len(variant_paths) and not os.path.exists(self.get_path(video_id)):
+                    unused_paths = unused_paths[1:]
+
+                for path in unused_paths:
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        continue
+
+        logging.debug('Store cleaned, removed copies = %d', removed)
+
+        return removed
+
+    def _get_video_dir(self, video_id):
+        return os.path.join(self._directory, video_id)
+
+    def _get_variant_paths(self, video_id):
+        """ returns paths of copies of video in order of their names """
+        video_dir = self._get_video_dir(video_id)
+        if not os.path.exists(video_dir):
+            return []
+
+        return [os.path.join(video_dir, filename) for filename in sorted(os.listdir(video_dir))
+                if self._variant_pattern.match(filename)]
+
+    def _get_info_path(self, video_id):
+        return os.path.join(self._get_video_dir(video_id), '{0}.json'.format(video_id))
+
+
+def _is_unused(path, created_before):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+
+    return stat.st_nlink == 1 and stat.st_mtime < created_before
+
+
+def get_store_profile(profile, transcode=True):
+    """ name of store directory, audio saved without transcoding does not depend on encoder profile """
+    return profile if transcode else constants.STORE_COPY_PROFILE
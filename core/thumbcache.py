@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+
+from . import constants
+from . import converter
+from . import util
+
+
+class ThumbCache(object):
+
+    """ class to keep thumbnails between runs, least recently used files are removed above size limit """
+
+    def __init__(self, directory, max_bytes=constants.THUMB_CACHE_MAX_BYTES, max_width=None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._max_width = max_width
+        self._lock = threading.Lock()
+        # size of cached files, directory is scanned when first thumbnail is added
+        self._total_size = None
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def get_path(self, video_id):
+        if self._max_width:
+            filename = '{0}_{1}.jpg'.format(video_id, self._max_width)
+        else:
+            filename = '{0}.jpg'.format(video_id)
+
+        return os.path.join(self._directory, filename)
+
+    def fetch(self, video_id, download, output_path):
+        """ saves thumbnail to output_path, download(path) is called to save it if it is not cached yet
+
+        output_path is hard link or copy of cached file, so eviction never removes thumbnail which is in use
+        """
+        path = self.get_path(video_id)
+
+        if os.path.exists(path):
+            try:
+                util.link_or_copy(path, output_path)
+                logging.debug('Thumbnail found in cache - %s', video_id)
+                # modification time is used as last access time for eviction
+                os.utime(path, None)
+                return output_path
+            except OSError:
+                # evicted meanwhile, e.g. by another process sharing the cache
+                logging.debug('Thumbnail removed from cache while it was read - %s', video_id)
+
+        # written under unique name and renamed, so concurrent readers never see partial file
+        partial_path = '{0}.{1}.part'.format(path, threading.get_ident())
+        try:
+            download(partial_path)
+            if self._max_width:
+                resized_path = partial_path + '.jpg'
+                converter.resize_image(partial_path, resized_path, self._max_width)
+                os.replace(resized_path, partial_path)
+            util.link_or_copy(partial_path, output_path)
+            size = os.path.getsize(partial_path)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        self._add(size)
+
+        return output_path
+
+    def _add(self, size):
+        with self._lock:
+            if self._total_size is None:
+                self._total_size = sum(size for _, size, _ in self._scan())
+            else:
+                self._total_size += size
+
+            if self._total_size > self._max_bytes:
+                self._evict()
+
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self._directory):
+            if entry.is_file() and entry.name.endswith('.jpg'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return entries
+
+    def _evict(self):
+        """ removes least recently used thumbnails until cache size is below eviction threshold """
+        # other processes could add or remove files, so actual sizes are taken before eviction
+        entries = self._scan()
+        self._total_size = sum(size for _, size, _ in entries)
+        threshold = self._max_bytes * constants.THUMB_CACHE_EVICT_FRACTION
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if self._total_size <= threshold:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._total_size -= size
+            removed += 1
+
+        logging.debug('Thumbnail cache evicted, removed = %d', removed)
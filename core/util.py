@@ -1,101 +1,183 @@
-import glob
-import json
+import base64
+import csv
+import itertools
 import logging
-import mutagen
-import mutagen.id3
 import os
+import re
 import shutil
 from urllib.parse import urlparse
 from urllib.parse import parse_qsl
-from urllib.request import urlopen
 
 from . import constants
+from . import index
 
 # supported_extensions = ['webm', 'm4a', 'wav']
 special_chars = ['<', '>', ':', '"', '\'', '/', '\\', '|', '?', '*', '.']
 
+# suffix of files which are being written, they are renamed when complete
+PARTIAL_SUFFIX = '.part'
+COPY_BUFFER_SIZE = 1024 * 1024
+
 
 def add_audio_metainfo(file_path, **kwargs):
+    # mutagen is imported only when audio is really tagged, it is not needed to start script
+    import mutagen
+    import mutagen.id3
+    import mutagen.mp4
+
     if not os.path.exists(file_path):
         raise IOError(u'Add audio metainfo failed, audio file not found - {0}'.format(file_path))
     if not os.path.isfile(file_path):
         raise IOError(u'Add audio metainfo failed, specified path is not file - {0}'.format(file_path))
 
     audio = mutagen.File(file_path)
+    if audio is None:
+        raise IOError(u'Add audio metainfo failed, unsupported audio format - {0}'.format(file_path))
+    if audio.tags is None:
+        audio.add_tags()
 
     cover_path = kwargs.get('cover_path')
     album = kwargs.get('album')
     track_num = kwargs.get('track_num')
+    video_id = kwargs.get('video_id')
+    title = kwargs.get('title')
+    artist = kwargs.get('artist')
 
-    # add image cover
+    image_data = None
     if cover_path:
         with open(cover_path, 'rb') as image_file:
             image_data = image_file.read()
-        audio.tags.add(mutagen.id3.APIC(
+
+    if isinstance(audio, mutagen.mp4.MP4):
+        _add_mp4_metainfo(audio.tags, image_data, album, track_num, video_id, title, artist)
+    elif isinstance(audio.tags, mutagen.id3.ID3):
+        _add_id3_metainfo(audio.tags, image_data, album, track_num, video_id, title, artist)
+    else:
+        _add_vorbis_metainfo(audio.tags, image_data, album, track_num, video_id, title, artist)
+
+    audio.save()
+
+
+def remove_album_tags(file_path, cover=False):
+    """ removes album and track number tags, e.g. before audio is tagged for another album, and cover if asked """
+    import mutagen
+    import mutagen.id3
+    import mutagen.mp4
+
+    audio = mutagen.File(file_path)
+    if audio is None or audio.tags is None:
+        return
+
+    if isinstance(audio, mutagen.mp4.MP4):
+        keys = ['\xa9alb', 'trkn'] + (['covr'] if cover else [])
+    elif isinstance(audio.tags, mutagen.id3.ID3):
+        keys = ['TALB', 'TRCK'] + (['APIC'] if cover else [])
+    else:
+        keys = ['album', 'tracknumber'] + (['metadata_block_picture'] if cover else [])
+
+    for key in keys:
+        if isinstance(audio.tags, mutagen.id3.ID3):
+            # id3 frames like covers are keyed by their description too
+            audio.tags.delall(key)
+        elif key in audio.tags:
+            del audio.tags[key]
+
+    audio.save()
+
+
+def _add_id3_metainfo(tags, image_data, album, track_num, video_id, title, artist):
+    import mutagen.id3
+
+    # add image cover
+    if image_data:
+        tags.add(mutagen.id3.APIC(
             encoding=3,
             mime='image/jpeg',
             type=0,
             data=image_data
         ))
+    # add title and artist
+    if title:
+        tags.add(mutagen.id3.TIT2(
+            encoding=3,
+            text=title
+        ))
+    if artist:
+        tags.add(mutagen.id3.TPE1(
+            encoding=3,
+            text=artist
+        ))
     # add album name
     if album:
-        audio.tags.add(mutagen.id3.TALB(
+        tags.add(mutagen.id3.TALB(
             encoding=3,
             text=album
         ))
     # add track number
     if track_num:
-        audio.tags.add(mutagen.id3.TRCK(
+        tags.add(mutagen.id3.TRCK(
             encoding=3,
             text=str(track_num)
         ))
-
-    audio.save()
-
-    pass
+    # add video id, so audio stays synchronized even if file was renamed
+    if video_id:
+        tags.add(mutagen.id3.TXXX(
+            encoding=3,
+            desc=constants.VIDEO_ID_TAG,
+            text=video_id
+        ))
 
 
-def get_local_audios(working_dir):
-    logging.info("Gethering all local audios from '%s'", working_dir)
+def _add_mp4_metainfo(tags, image_data, album, track_num, video_id, title, artist):
+    import mutagen.mp4
 
-    working_dir = os.path.join(working_dir, '')
+    if image_data:
+        tags['covr'] = [mutagen.mp4.MP4Cover(image_data, imageformat=mutagen.mp4.MP4Cover.FORMAT_JPEG)]
+    if title:
+        tags['\xa9nam'] = [title]
+    if artist:
+        tags['\xa9ART'] = [artist]
+    if album:
+        tags['\xa9alb'] = [album]
+    if track_num:
+        tags['trkn'] = [(int(track_num), 0)]
+    if video_id:
+        tags[constants.MP4_VIDEO_ID_TAG] = [mutagen.mp4.MP4FreeForm(video_id.encode('utf-8'))]
+
+
+def _add_vorbis_metainfo(tags, image_data, album, track_num, video_id, title, artist):
+    import mutagen.flac
+
+    if image_data:
+        # vorbis comments keep cover as base64 encoded flac picture block
+        picture = mutagen.flac.Picture()
+        picture.type = 3
+        picture.mime = 'image/jpeg'
+        picture.data = image_data
+        tags['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+    if title:
+        tags['title'] = [title]
+    if artist:
+        tags['artist'] = [artist]
+    if album:
+        tags['album'] = [album]
+    if track_num:
+        tags['tracknumber'] = [str(track_num)]
+    if video_id:
+        tags[constants.VIDEO_ID_TAG.lower()] = [video_id]
 
-    local_audios = set()
 
-    # get only mp3 files
-    for local_audio in glob.glob(u'{0}/*.mp3'.format(working_dir)):
-        filename_only = local_audio[len(working_dir):]
-        filename, extension = get_filename_with_extension(filename_only)
-        local_audios.add(filename)
+def get_local_video_ids(working_dir):
+    logging.info("Gethering video ids of all local audios from '%s'", working_dir)
 
-    return local_audios
+    return index.get_index(working_dir).video_ids()
 
 
 def get_last_track_number(working_dir, album=None):
     logging.info('Searching for last track number in album')
 
-    files = glob.glob(u'{0}/*.mp3'.format(working_dir))
     if album:
-        max_track_number = 0
-        for audio in files:
-            info = mutagen.File(audio)
-
-            audio_album = None
-            mutagen_audio_album = info.get('TALB')
-            if mutagen_audio_album:
-                audio_album = mutagen_audio_album.text[0]
-
-            mutagen_track_number = info.get('TRCK')
-
-            track_number = 0
-            try:
-                if mutagen_track_number:
-                    track_number = int(mutagen_track_number.text[0])
-            except ValueError:
-                logging.debug('Track number error, must be integer, current value is "%s"', info.get('TRCK'))
-
-            if audio_album == album and track_number > max_track_number:
-                max_track_number = track_number
+        max_track_number = index.get_index(working_dir).get_last_track_number(album)
     else:
         max_track_number = 0
 
@@ -109,6 +191,7 @@ def get_filename_with_extension(filename):
 
 def get_temp_sub_dirs():
     temp_sub_dirs = [
+        constants.AUDIO_TEMP_DIR,
         constants.IMAGE_TEMP_DIR,
         constants.VIDEO_TEMP_DIR
     ]
@@ -116,6 +199,23 @@ def get_temp_sub_dirs():
     return temp_sub_dirs
 
 
+def get_cache_dir():
+    cache_root = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA')
+    if not cache_root:
+        cache_root = os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(cache_root, constants.CACHE_DIR_NAME)
+
+
+def peek(iterable):
+    """ returns first item and iterator over all items including first one, first item is None if empty """
+    iterator = iter(iterable)
+    for first in iterator:
+        return first, itertools.chain([first], iterator)
+
+    return None, iter(())
+
+
 def get_url_params(url):
     parameters = dict()
 
@@ -128,12 +228,27 @@ def get_url_params(url):
     return parameters
 
 
-def copy(input_file, output_file, remove_old=False):
+def copy(input_file, output_file, remove_old=False, fsync=False):
+    """ copies file into temporary file next to output and renames it, so output is never seen half written """
     if os.path.exists(input_file):
         if os.path.isfile(input_file):
             if not os.path.exists(os.path.dirname(output_file)):
                 os.makedirs(os.path.dirname(output_file))
-            shutil.copy2(input_file, output_file)
+            partial_file = output_file + PARTIAL_SUFFIX
+            try:
+                with open(input_file, 'rb') as source, open(partial_file, 'wb') as destination:
+                    shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
+                    if fsync:
+                        destination.flush()
+                        os.fsync(destination.fileno())
+                shutil.copystat(input_file, partial_file)
+                os.replace(partial_file, output_file)
+            except Exception:
+                if os.path.exists(partial_file):
+                    os.remove(partial_file)
+                raise
+            if fsync:
+                fsync_dir(os.path.dirname(output_file))
             if remove_old:
                 os.remove(input_file)
         else:
@@ -142,6 +257,78 @@ def copy(input_file, output_file, remove_old=False):
         raise IOError('Copy failed, input file not found - {0}'.format(input_file))
 
 
+def move(input_file, output_file, fsync=False):
+    """ renames file into output, file is streamed to output only when it is on another device """
+    if not os.path.isfile(input_file):
+        raise IOError('Move failed, input file not found - {0}'.format(input_file))
+
+    output_dir = os.path.dirname(output_file)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if os.stat(input_file).st_dev != os.stat(output_dir).st_dev:
+        logging.debug('"%s" is on another device, copying it', input_file)
+        copy(input_file, output_file, remove_old=True, fsync=fsync)
+        return
+
+    if fsync:
+        # data has to be on disk before rename is, otherwise crash could leave empty file under final name
+        with open(input_file, 'rb+') as source:
+            os.fsync(source.fileno())
+    os.replace(input_file, output_file)
+    if fsync:
+        fsync_dir(output_dir)
+
+
+def fsync_dir(directory):
+    """ flushes directory entries, so renames in it survive crash, not supported on windows """
+    if os.name == 'nt':
+        return
+
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def link_or_copy(input_file, output_file, fsync=False):
+    """ hard links file, falls back to copy if linking is not possible, e.g. another device """
+    partial_file = output_file + PARTIAL_SUFFIX
+    if os.path.exists(partial_file):
+        os.remove(partial_file)
+    try:
+        os.link(input_file, partial_file)
+    except OSError as ex:
+        logging.debug('Could not hard link "%s", copying it - %s', input_file, str(ex))
+        copy(input_file, output_file, fsync=fsync)
+        return
+
+    # existing file is replaced at once, readers see either old file or new one
+    os.replace(partial_file, output_file)
+    if fsync:
+        fsync_dir(os.path.dirname(output_file))
+
+
+def read_batch_file(batch_path, default_folder):
+    """ reads batch file, every line is 'playlist id[,album[,folder]]', '#' starts comment """
+    batch_entries = []
+
+    with open(batch_path, newline='', encoding='utf-8') as batch_file:
+        for row in csv.reader(batch_file):
+            if not row or not row[0].strip() or row[0].strip().startswith('#'):
+                continue
+
+            row = [value.strip() for value in row] + [''] * 2
+            batch_entries.append({
+                'playlist': row[0],
+                'album': row[1] or None,
+                'folder': re.sub('["|\']+', '', row[2]) or default_folder
+            })
+
+    return batch_entries
+
+
 # root - absolute path to working directory
 def create_temp_dir(root):
     logging.info('Creating temp dirs')
@@ -150,10 +337,14 @@ def create_temp_dir(root):
 
     root_temp = os.path.join(root, constants.ROOT_TEMP_DIR)
 
-    os.makedirs(root_temp)
+    # temp dir could be left by interrupted run, its files are reused to resume it
+    if not os.path.exists(root_temp):
+        os.makedirs(root_temp)
 
     for temp_subdir in temp_subdirs:
-        os.makedirs(os.path.join(root_temp, temp_subdir))
+        temp_subdir_path = os.path.join(root_temp, temp_subdir)
+        if not os.path.exists(temp_subdir_path):
+            os.makedirs(temp_subdir_path)
 
     logging.info('Finished creating temp dirs')
 
@@ -163,24 +354,42 @@ def clean_temp_dir(root):
     logging.info('Cleaning temp files')
 
     root_temp = os.path.join(root, constants.ROOT_TEMP_DIR)
-    temp_sub_dirs = get_temp_sub_dirs()
 
     if os.path.exists(root_temp):
-
-        for temp_subdir in temp_sub_dirs:
-            temp_subdir_path = os.path.join(root_temp, temp_subdir)
-            if os.path.exists(temp_subdir_path):
-                for temp_file in glob.glob(u'{0}/*.*'.format(temp_subdir_path)):
-                    os.remove(temp_file)
-                os.rmdir(temp_subdir_path)
-
-        os.rmdir(root_temp)
+        shutil.rmtree(root_temp)
 
         logging.info('Finished cleaning temp files')
     else:
         logging.info('Skipping ...')
 
 
+# root - absolute path to working directory
+def remove_temp_files(root, video_id):
+    """ removes temp files of single video, e.g. leftovers of interrupted download """
+    root_temp = os.path.join(root, constants.ROOT_TEMP_DIR)
+    prefix = video_id + '.'
+
+    for temp_subdir in get_temp_sub_dirs():
+        temp_subdir_path = os.path.join(root_temp, temp_subdir)
+        if not os.path.exists(temp_subdir_path):
+            continue
+        for entry in os.scandir(temp_subdir_path):
+            if entry.name.startswith(prefix) and entry.is_file():
+                os.remove(entry.path)
+
+
+# root - absolute path to working directory
+def clean_temp_files(root):
+    """ removes files of finished videos, root temp directory itself with journal is kept """
+    root_temp = os.path.join(root, constants.ROOT_TEMP_DIR)
+
+    for temp_subdir in get_temp_sub_dirs():
+        temp_subdir_path = os.path.join(root_temp, temp_subdir)
+        if os.path.exists(temp_subdir_path):
+            shutil.rmtree(temp_subdir_path)
+        os.makedirs(temp_subdir_path)
+
+
 def generate_video_title(video_title, video_id, extension=None, clean=None):
     # use unicode video title + videoId to avoid duplicate errors
     video_title = video_title + ' [{}]'.format(video_id)
@@ -193,19 +402,3 @@ def generate_video_title(video_title, video_id, extension=None, clean=None):
         video_title += '.{0}'.format(extension)
 
     return video_title
-
-
-def json_url_open(url):
-    logging.debug('Request to: %s', url)
-
-    logging.debug('Performing request')
-    response = urlopen(url)
-
-    logging.debug('Parsing response')
-    json_response = json.load(response)
-
-    response.close()
-
-    logging.debug('Response as json: %s', json.dumps(json_response, indent=4))
-
-    return json_response
@@ -0,0 +1,208 @@
+import json
+import sqlite3
+import threading
+import time
+
+from . import constants
+
+
+# item states
+STATE_QUEUED = 'queued'
+STATE_LEASED = 'leased'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+
+class WorkQueue(object):
+
+    """ class to share tasks between processes and hosts, every task is leased by one worker at a time
+
+    task which lease expired, e.g. its worker died, is given to another worker, so task could be done more
+    than once but is never lost
+    """
+
+    def __init__(self, path, lease_timeout=constants.QUEUE_LEASE_TIMEOUT, max_attempts=constants.MAX_ATTEMPT):
+        self._lease_timeout = lease_timeout
+        self._max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # transactions are started explicitly, lease has to lock database before it reads free items
+        self._connection = sqlite3.connect(path, timeout=constants.QUEUE_BUSY_TIMEOUT, isolation_level=None,
+                                           check_same_thread=False)
+        # pending are targets added while task is leased, they are queued again when worker finishes task
+        self._connection.execute('CREATE TABLE IF NOT EXISTS items ('
+                                 'position INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                 'video_id TEXT UNIQUE, '
+                                 'state TEXT, '
+                                 'owner TEXT, '
+                                 'lease_expires REAL, '
+                                 'attempts INTEGER, '
+                                 'task TEXT, '
+                                 'pending TEXT, '
+                                 'result TEXT)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS items_state ON items (state, position)')
+
+    def enqueue(self, video_id, task):
+        """ adds task, targets of task which is already in queue are merged by working directory
+
+        task which is done is queued again with given targets only, they miss audio, targets added to leased
+        task are queued again after its worker finishes it
+        """
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute('SELECT state, task, pending FROM items WHERE video_id = ?',
+                                               (video_id,)).fetchone()
+                if row is None:
+                    self._connection.execute('INSERT INTO items (video_id, state, attempts, task) VALUES (?, ?, 0, ?)',
+                                             (video_id, STATE_QUEUED, json.dumps(task)))
+                else:
+                    self._merge(video_id, row, task)
+                self._connection.execute('COMMIT')
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+
+    def lease(self, owner, count=1):
+        """ returns up to count queued or expired tasks, they are leased by owner for lease timeout """
+        now = time.time()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._connection.execute('SELECT video_id, task FROM items '
+                                                'WHERE state = ? OR (state = ? AND lease_expires < ?) '
+                                                'ORDER BY position LIMIT ?',
+                                                (STATE_QUEUED, STATE_LEASED, now, count)).fetchall()
+                self._connection.executemany('UPDATE items SET state = ?, owner = ?, lease_expires = ?, '
+                                             'attempts = attempts + 1 WHERE video_id = ?',
+                                             [(STATE_LEASED, owner, now + self._lease_timeout, row[0])
+                                              for row in rows])
+                self._connection.execute('COMMIT')
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+
+        return [json.loads(row[1]) for row in rows]
+
+    def renew(self, owner):
+        """ extends leases of all tasks of owner, called periodically while tasks are in progress """
+        with self._lock:
+            self._connection.execute('UPDATE items SET lease_expires = ? WHERE state = ? AND owner = ?',
+                                     (time.time() + self._lease_timeout, STATE_LEASED, owner))
+
+    def ack(self, video_id, owner, result=None):
+        """ marks task done, returns False if task is not leased by owner anymore, e.g. its lease expired """
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute('SELECT task, pending FROM items '
+                                               'WHERE video_id = ? AND state = ? AND owner = ?',
+                                               (video_id, STATE_LEASED, owner)).fetchone()
+                if row is not None and row[1]:
+                    # targets added while task was in progress are saved by next worker
+                    task = json.loads(row[0])
+                    task['targets'] = json.loads(row[1])
+                    self._connection.execute('UPDATE items SET state = ?, owner = NULL, attempts = 0, task = ?, '
+                                             'pending = NULL, result = ? WHERE video_id = ?',
+                                             (STATE_QUEUED, json.dumps(task), json.dumps(result), video_id))
+                elif row is not None:
+                    self._connection.execute('UPDATE items SET state = ?, owner = NULL, result = ? '
+                                             'WHERE video_id = ?', (STATE_DONE, json.dumps(result), video_id))
+                self._connection.execute('COMMIT')
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+
+        return row is not None
+
+    def nack(self, video_id, owner):
+        """ returns task into queue, task which failed too many times is marked as failed
+
+        returns False if task is not leased by owner anymore
+        """
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute('SELECT task, pending FROM items '
+                                               'WHERE video_id = ? AND state = ? AND owner = ?',
+                                               (video_id, STATE_LEASED, owner)).fetchone()
+                if row is not None:
+                    task = json.loads(row[0])
+                    task['targets'] = _merge_targets(task['targets'], json.loads(row[1] or '[]'))
+                    self._connection.execute('UPDATE items SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+                                             'owner = NULL, task = ?, pending = NULL WHERE video_id = ?',
+                                             (self._max_attempts, STATE_FAILED, STATE_QUEUED, json.dumps(task),
+                                              video_id))
+                self._connection.execute('COMMIT')
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+
+        return row is not None
+
+    def video_ids(self, working_dir):
+        """ ids of queued or leased tasks which have target in working directory
+
+        done tasks are not included, local index decides whether their audio is still there
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT video_id, task, pending FROM items WHERE state IN (?, ?)',
+                                            (STATE_QUEUED, STATE_LEASED)).fetchall()
+
+        return set(row[0] for row in rows
+                   if any(target['working_dir'] == working_dir for target in _get_targets(row[1], row[2])))
+
+    def counts(self):
+        with self._lock:
+            return dict(self._connection.execute('SELECT state, COUNT(*) FROM items GROUP BY state').fetchall())
+
+    def get_last_track_number(self, working_dir, album):
+        with self._lock:
+            rows = self._connection.execute('SELECT task, pending FROM items WHERE state != ?',
+                                            (STATE_FAILED,)).fetchall()
+
+        max_track_number = 0
+        for row in rows:
+            for target in _get_targets(row[0], row[1]):
+                if target['working_dir'] == working_dir and target['album'] == album:
+                    max_track_number = max(max_track_number, target['track_num'] or 0)
+
+        return max_track_number
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _merge(self, video_id, row, task):
+        state, queued_task, pending = row
+        queued_task = json.loads(queued_task)
+
+        if state == STATE_LEASED:
+            pending = json.loads(pending or '[]')
+            targets = _merge_targets(pending, _get_new_targets(queued_task['targets'], task['targets']))
+            if len(targets) > len(pending):
+                self._connection.execute('UPDATE items SET pending = ? WHERE video_id = ?',
+                                         (json.dumps(targets), video_id))
+        elif state == STATE_DONE:
+            # producer puts only targets which miss audio, e.g. new directories or deleted files
+            queued_task['targets'] = task['targets']
+            self._connection.execute('UPDATE items SET state = ?, attempts = 0, task = ? WHERE video_id = ?',
+                                     (STATE_QUEUED, json.dumps(queued_task), video_id))
+        else:
+            queued_task['targets'] = _merge_targets(queued_task['targets'], task['targets'])
+            self._connection.execute('UPDATE items SET state = ?, attempts = 0, task = ? WHERE video_id = ?',
+                                     (STATE_QUEUED, json.dumps(queued_task), video_id))
+
+
+def _get_targets(task, pending):
+    return json.loads(task).get('targets', []) + json.loads(pending or '[]')
+
+
+def _get_new_targets(targets, new_targets):
+    """ targets of new_targets which working directories are not in targets """
+    working_dirs = set(target['working_dir'] for target in targets)
+
+    return [target for target in new_targets if target['working_dir'] not in working_dirs]
+
+
+def _merge_targets(targets, new_targets):
+    return targets + _get_new_targets(targets, new_targets)
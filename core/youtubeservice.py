@@ -1,38 +1,129 @@
 import logging
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from urllib.parse import urlencode
 
 from . import constants
+from . import converter
+from . import httpclient
+from . import index
+from . import journal
+from . import pipeline
+from . import scheduler
 from . import util
-from .downloader.ytdl import YtdlMedia
+from . import workqueue
 
 
 YOUTUBE_API_URL = 'https://www.googleapis.com/youtube/v3'
-YOUTUBE_PLAYLIST_API_URL = YOUTUBE_API_URL + '/playlists?part=snippet&key={0}&id={1}'
-YOUTUBE_PLAYLIST_ITEMS_API_URL = YOUTUBE_API_URL + '/playlistItems?part=id,contentDetails,snippet&key={0}&playlistId={1}&pageToken={2}'
-YOUTUBE_PLAYLIST_NEXT_PAGE = '&pageToken={0}'
 YOUTUBE_WATCH_URL = 'https://www.youtube.com/watch?v={0}'
 
+# api resources
+PLAYLISTS_RESOURCE = 'playlists'
+PLAYLIST_ITEMS_RESOURCE = 'playlistItems'
+VIDEOS_RESOURCE = 'videos'
+
+# partial responses, only fields which are really used are requested
+PLAYLISTS_FIELDS = 'pageInfo/totalResults,items/snippet(title,channelTitle)'
+PLAYLIST_ITEMS_FIELDS = 'nextPageToken,pageInfo(totalResults,resultsPerPage),items/contentDetails/videoId'
+VIDEOS_FIELDS = 'items(id,status(uploadStatus,privacyStatus),contentDetails(duration,regionRestriction))'
+MAX_RESULTS = 50
+# videos.list accepts up to 50 ids, maxResults is not supported together with id
+MAX_VIDEO_IDS = 50
+
+# iso 8601 duration, e.g. PT1H2M3S
+DURATION_PATTERN = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
 # response variables
+ALLOWED 			= 'allowed'
+BLOCKED 			= 'blocked'
 CHANNEL_TITLE 		= 'channelTitle'
 CONTENT_DETAILS 	= 'contentDetails'
+DURATION 			= 'duration'
 ID 					= 'id'
 ITEMS 				= 'items'
 NEXT_PAGE_TOKEN 	= 'nextPageToken'
 PAGE_INFO 			= 'pageInfo'
+PRIVACY_STATUS 		= 'privacyStatus'
+REGION_RESTRICTION 	= 'regionRestriction'
 RESULTS_PER_PAGE 	= 'resultsPerPage'
 SNIPPET 			= 'snippet'
+STATUS 				= 'status'
 TITLE 				= 'title'
 TOTAL_RESULTS 		= 'totalResults'
+UPLOAD_STATUS 		= 'uploadStatus'
 VIDEO_ID 			= 'videoId'
 
+# shared between all api requests to reuse connections
+_http_client = httpclient.HttpClient()
+# thumbnails are fetched in background while audio is downloading
+_thumb_executor = ThreadPoolExecutor(max_workers=constants.THUMB_WORKERS, thread_name_prefix='thumb')
+_thumb_cache = None
+_run_metrics = None
+_disk_budget = None
+_media_store = None
+# youtube-dl options of every download, e.g. concurrent fragments
+_ytdl_options = dict()
+
+
+def set_response_cache(response_cache):
+    _http_client.set_cache(response_cache)
+
+
+def set_thumb_cache(thumb_cache):
+    global _thumb_cache
+    _thumb_cache = thumb_cache
+
+
+def set_disk_budget(disk_budget):
+    global _disk_budget
+    _disk_budget = disk_budget
+
+
+def set_media_store(media_store):
+    global _media_store
+    _media_store = media_store
+
+
+def set_ytdl_options(ytdl_options):
+    global _ytdl_options
+    _ytdl_options = dict(ytdl_options)
+
+
+def set_run_metrics(run_metrics):
+    global _run_metrics
+    _run_metrics = run_metrics
+
+
+def measure(stage, video_id=None):
+    """ measures stage of the video if run metrics are set, block gets dict to add own values to """
+    if _run_metrics is None:
+        return nullcontext(dict())
+
+    return _run_metrics.measure(stage, video_id)
+
+
+def api_request(resource, api_key, **params):
+    # api key is not part of cache key, cached responses do not depend on it
+    cache_key = '{0}?{1}'.format(resource, urlencode(sorted(params.items())))
+
+    params['key'] = api_key
+    url = '{0}/{1}?{2}'.format(YOUTUBE_API_URL, resource, urlencode(params))
+
+    with measure('api'):
+        return scheduler.get_scheduler().call(url, _http_client.get_json, url, cache_key=cache_key)
+
 
 def get_playlist_info(api_key, playlist_id):
     logging.info('Retrieving information about playlist with id = %s', playlist_id)
 
     try:
-        url = YOUTUBE_PLAYLIST_API_URL.format(api_key, playlist_id)
-
-        json_response = util.json_url_open(url)
+        json_response = api_request(PLAYLISTS_RESOURCE, api_key, part='snippet', id=playlist_id,
+                                    fields=PLAYLISTS_FIELDS)
 
         logging.debug('Retrieving playlist info')
 
@@ -56,28 +147,31 @@ def get_playlist_info(api_key, playlist_id):
         raise ex
 
 
-def get_videos_from_playlist(api_key, playlist_id):
+def get_videos_from_playlist(api_key, playlist_id, known_ids=None):
+    """ yields videos page by page, next page is requested only when previous one is consumed
+
+    known_ids are given for playlists which have newest videos first, paging stops after first page
+    without new videos
+    """
     logging.info('Retrieving videos from playlist with id = %s', playlist_id)
 
-    videos = []
     try:
         done = False
         next_page_token = ''
         page = 0
         while not done:
-            url = YOUTUBE_PLAYLIST_ITEMS_API_URL.format(api_key, playlist_id, next_page_token)
-
-            json_response = util.json_url_open(url)
+            json_response = api_request(PLAYLIST_ITEMS_RESOURCE, api_key, part='contentDetails',
+                                        playlistId=playlist_id, pageToken=next_page_token,
+                                        maxResults=MAX_RESULTS, fields=PLAYLIST_ITEMS_FIELDS)
 
             results_per_page = json_response.get(PAGE_INFO).get(RESULTS_PER_PAGE)
             total_results = json_response.get(PAGE_INFO).get(TOTAL_RESULTS)
 
             if total_results is None or total_results == 0:
                 logging.info('No videos in this playlits, id = %s', playlist_id)
-
-            total_pages = total_results / results_per_page
-            if total_results % results_per_page > 0:
-                total_pages += 1
+                total_pages = 0
+            else:
+                total_pages = -(-total_results // results_per_page)
 
             page += 1
 
@@ -86,12 +180,16 @@ def get_videos_from_playlist(api_key, playlist_id):
             json_videos = json_response.get(ITEMS)
 
             for json_video in json_videos:
-                videos.append(json_video)
+                yield json_video
 
             next_page_token = json_response.get(NEXT_PAGE_TOKEN)
 
             if next_page_token is None:
                 done = True
+            elif known_ids is not None and all(json_video.get(CONTENT_DETAILS).get(VIDEO_ID) in known_ids
+                                               for json_video in json_videos):
+                logging.info('No new videos on page %d, older pages are not requested', page)
+                done = True
 
     except Exception as ex:
         logging.error('An exception raised while retrieving videos from playlist')
@@ -99,42 +197,41 @@ def get_videos_from_playlist(api_key, playlist_id):
 
     logging.info('Done with retrieving videos from playlist')
 
-    return videos
-
 
 def synchronize_audios(videos, working_dir):
+    """ yields only videos which are not saved in working directory yet """
     logging.info('Synchronizing all videos from youtube playlist with local playlist')
 
-    audios_to_download = []
-
     try:
-        local_audios = util.get_local_audios(working_dir)
+        local_video_ids = util.get_local_video_ids(working_dir)
 
-        logging.debug('Local audios = %d, cloud videos = %d', len(local_audios), len(videos))
+        logging.debug('Local audios = %d', len(local_video_ids))
 
+        seen_ids = set()
+        cloud_videos = 0
+        audios_to_download = 0
         for cloud_video in videos:
-            audio_title = cloud_video.get(SNIPPET).get(TITLE)
+            cloud_videos += 1
+
             content_details_json = cloud_video.get(CONTENT_DETAILS)
             audio_id = content_details_json.get(VIDEO_ID)
 
-            audio_title_full = util.generate_video_title(audio_title, audio_id, clean=True)
-            if audio_title_full not in local_audios:
-                audios_to_download.append(cloud_video)
+            # compare by video id, renamed videos are not downloaded again, repeated videos are given once
+            if audio_id not in local_video_ids and audio_id not in seen_ids:
+                seen_ids.add(audio_id)
+                audios_to_download += 1
+                yield cloud_video
 
-        logging.info('Files to download - %s', len(audios_to_download))
+        logging.info('Files to download - %s of %s', audios_to_download, cloud_videos)
 
     except Exception as ex:
         logging.error('An error occurred while synchronizing audios')
         raise ex
 
-    return audios_to_download
-
 
 def get_playlist_video_info(videos_as_json):
     logging.info('Retrieving videos urls from json response')
 
-    urls = []
-
     try:
         for video in videos_as_json:
 
@@ -143,13 +240,95 @@ def get_playlist_video_info(videos_as_json):
             video_url = content_details_json.get(VIDEO_ID)
 
             if video_url is not None:
-                urls.append({VIDEO_ID: video_url})
+                yield {VIDEO_ID: video_url}
 
     except Exception as ex:
         logging.error('An error occurred while retrieving videos url from response')
         raise ex
 
-    return urls
+
+def get_playable_videos(api_key, video_info_list, region=None):
+    """ yields only videos which could be downloaded, adds their duration in seconds
+
+    videos are checked by batches of 50 ids per request, deleted, private, not processed, live or upcoming videos
+    and videos blocked in region are dropped before they reach downloader
+    """
+    logging.info('Checking availability of videos')
+
+    try:
+        checked_videos = 0
+        dropped_videos = 0
+        for batch in _get_batches(video_info_list, MAX_VIDEO_IDS):
+            json_response = api_request(VIDEOS_RESOURCE, api_key, part='status,contentDetails',
+                                        id=','.join(video_info[VIDEO_ID] for video_info in batch),
+                                        fields=VIDEOS_FIELDS)
+
+            # deleted and private videos are not returned at all
+            json_videos = dict((json_video.get(ID), json_video) for json_video in json_response.get(ITEMS))
+
+            for video_info in batch:
+                checked_videos += 1
+
+                reason = get_unplayable_reason(json_videos.get(video_info[VIDEO_ID]), region)
+                if reason:
+                    dropped_videos += 1
+                    logging.info('Skipping video "%s", it is %s', video_info[VIDEO_ID], reason)
+                    continue
+
+                content_details_json = json_videos[video_info[VIDEO_ID]].get(CONTENT_DETAILS)
+                video_info[DURATION] = parse_duration(content_details_json.get(DURATION))
+                yield video_info
+
+        logging.info('Unavailable videos skipped - %d of %d', dropped_videos, checked_videos)
+
+    except Exception as ex:
+        logging.error('An error occurred while checking availability of videos')
+        raise ex
+
+
+def get_unplayable_reason(json_video, region=None):
+    if json_video is None:
+        return 'deleted or private'
+
+    status = json_video.get(STATUS, {})
+    if status.get(PRIVACY_STATUS) == 'private':
+        return 'private'
+    if status.get(UPLOAD_STATUS) not in (None, 'processed'):
+        return status.get(UPLOAD_STATUS)
+
+    content_details = json_video.get(CONTENT_DETAILS, {})
+    if not parse_duration(content_details.get(DURATION)):
+        return 'live or upcoming'
+
+    restriction = content_details.get(REGION_RESTRICTION)
+    if region and restriction:
+        if region in restriction.get(BLOCKED, []) or (ALLOWED in restriction and region not in restriction[ALLOWED]):
+            return 'blocked in region {0}'.format(region)
+
+    return None
+
+
+def parse_duration(duration):
+    """ iso 8601 duration in seconds, None if it could not be parsed """
+    match = DURATION_PATTERN.match(duration or '')
+    if not match:
+        return None
+
+    days, hours, minutes, seconds = (int(value or 0) for value in match.groups())
+
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def _get_batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
 
 
 def get_single_video_urls(video_url):
@@ -169,7 +348,9 @@ def get_single_video_urls(video_url):
     return video_info
 
 
-def download_data_from_video(video_id, root):
+def download_data_from_video(video_id, root, source_format='bestaudio', duration=None):
+    # downloader is not needed when there is nothing to download
+    from .downloader import ytdl
 
     temp_dir = os.path.join(root, constants.ROOT_TEMP_DIR)
     video_temp_dir = os.path.join(temp_dir, constants.VIDEO_TEMP_DIR)
@@ -178,46 +359,487 @@ def download_data_from_video(video_id, root):
         url = YOUTUBE_WATCH_URL.format(video_id)
         logging.debug('Working with url: %s', url)
 
-        video = YtdlMedia(url, temp_dir)
+        video = ytdl.YtdlMedia(url, temp_dir, video_id=video_id, **_ytdl_options)
+
+        def download_thumb():
+            with measure('thumb', video_id):
+                return video.download_thumb(_thumb_cache)
+
+        thumb_future = _thumb_executor.submit(download_thumb)
 
         logging.debug('Downloading video for url: %s', url)
 
-        result = video.download_audio(post_format='mp3')
+        def reserve_disk(ytdl_info):
+            if _disk_budget is None:
+                return
+            estimated_size = ytdl.get_estimated_size(ytdl_info)
+            if not estimated_size and duration:
+                estimated_size = duration * constants.ESTIMATED_AUDIO_BITRATE // 8
+            estimated_size = estimated_size or constants.DISK_BUDGET_UNKNOWN_SIZE
+            with measure('disk_wait', video_id):
+                wait_started = time.perf_counter()
+                _disk_budget.acquire(video_id, estimated_size * constants.DISK_BUDGET_SIZE_FACTOR)
+                # download time and rate do not include waiting for disk budget
+                values['idle_wall'] = time.perf_counter() - wait_started
+
+        with measure('download', video_id) as values:
+            result = video.download_audio(source_format=source_format, before_download=reserve_disk)
+            result['audio_path'] = os.path.join(video_temp_dir, result.get('audio_filename'))
+            values['bytes'] = os.path.getsize(result['audio_path'])
+
+        result_i = thumb_future.result()
+        result.update(result_i)
+    except Exception as ex:
+        logging.error('An error occurred while downloading audios from videos')
+        raise ex
+
+    return result
+
+
+def get_audio_metadata(result, target):
+    metadata = {
+        'title': result.get('title'),
+        'artist': result.get('artist'),
+        'album': target['album'],
+        'track': target['track_num'],
+        constants.VIDEO_ID_TAG: result.get('id')
+    }
+
+    return dict((key, value) for key, value in metadata.items() if value)
+
+
+def convert_audio_from_video(result, root, audio_format=constants.DEFAULT_AUDIO_FORMAT, transcode=True,
+                             target=None, profile=constants.DEFAULT_ENCODER_PROFILE, threads=None):
+    """ converts downloaded audio, if target is given and format allows it, tags are written by ffmpeg too """
+    audio_temp_dir = os.path.join(root, constants.ROOT_TEMP_DIR, constants.AUDIO_TEMP_DIR)
+
+    try:
+        converted_path = os.path.join(audio_temp_dir, '{0}.{1}'.format(result.get('id'), audio_format))
+
+        logging.debug('Converting audio to %s: %s', audio_format, result.get('audio_path'))
+
+        metadata = None
+        cover_path = None
+        if target and audio_format in constants.FFMPEG_TAGGED_FORMATS:
+            metadata = get_audio_metadata(result, target)
+            cover_path = result.get('thumb_path')
+
+        with measure('convert', result.get('id')) as values:
+            converter.convert_audio(result.get('audio_path'), converted_path, codec=audio_format,
+                                    transcode=transcode, metadata=metadata, cover_path=cover_path, stats=values,
+                                    profile=profile, threads=threads)
+
+        # downloaded audio is not needed anymore, its space is freed before audio is saved
+        if result.get('audio_path') != converted_path:
+            os.remove(result.get('audio_path'))
+
+        result['audio_ext'] = audio_format
+        result['audio_path'] = converted_path
+        # album and track number already written into file
+        result['embedded_tags'] = [target['album'], target['track_num']] if metadata else None
+    except Exception as ex:
+        logging.error('An error occurred while converting audio')
+        raise ex
+
+    logging.info(u'Audio converted: {0}'.format(result.get('title')))
 
+    return result
+
+
+def make_target(working_dir, album=None, track_num=None):
+    return {
+        'working_dir': working_dir,
+        'album': album,
+        'track_num': track_num
+    }
+
+
+def finalize_audio(result, targets, fsync=False):
+    """ saves converted audio into every target directory, tagged with target album and track number
+
+    audio is tagged while it is still in temp directory and then renamed into target, so target directory never
+    has half written or half tagged file
+    """
+    try:
         end_filename = util.generate_video_title(result.get('title'), result.get('id'), result.get('audio_ext'),
                                                  clean=True)
-        util.copy(os.path.join(video_temp_dir, (video_id + '.' + result.get('audio_ext'))),
-                  os.path.join(root, end_filename),
-                  remove_old=True)
+
+        # targets with the same tags share one file, last of them takes converted file itself instead of a copy
+        owners = OrderedDict()
+        for target in targets:
+            owners.setdefault((target['album'], target['track_num']), target)
+        last_owner = list(owners.values())[-1]
+
+        saved = OrderedDict()
+        audio_paths = []
+        for position, target in enumerate(targets):
+            audio_path = os.path.join(target['working_dir'], end_filename)
+            tags = (target['album'], target['track_num'])
+
+            if tags in saved:
+                # same tags in another directory, file can be shared instead of tagging a copy again
+                with measure('copy', result.get('id')):
+                    util.link_or_copy(saved[tags], audio_path, fsync=fsync)
+            else:
+                staged_path = result.get('audio_path')
+                if target is not last_owner:
+                    root, extension = os.path.splitext(staged_path)
+                    staged_path = '{0}.{1}{2}'.format(root, position, extension)
+                    with measure('copy', result.get('id')) as values:
+                        util.copy(result.get('audio_path'), staged_path)
+                        values['bytes'] = os.path.getsize(staged_path)
+
+                if result.get('embedded_tags') != list(tags):
+                    with measure('tag', result.get('id')):
+                        if result.get('embedded_tags') is not None:
+                            # tags of another target were written by ffmpeg, they are replaced, not added to
+                            util.remove_album_tags(staged_path, cover=True)
+                        util.add_audio_metainfo(staged_path, cover_path=result.get('thumb_path'),
+                                                track_num=target['track_num'], album=target['album'],
+                                                video_id=result.get('id'), title=result.get('title'),
+                                                artist=result.get('artist'))
+
+                with measure('move', result.get('id')):
+                    util.move(staged_path, audio_path, fsync=fsync)
+                saved[tags] = audio_path
+
+            index.get_index(target['working_dir']).add(end_filename, video_id=result.get('id'),
+                                                       album=target['album'], track_num=target['track_num'])
+            audio_paths.append(audio_path)
+
         result['audio_filename'] = end_filename
-        result_i = video.download_thumb()
-        result.update(result_i)
+        result['audio_paths'] = audio_paths
     except Exception as ex:
-        logging.error('An error occurred while downloading audios from videos')
+        logging.error('An error occurred while saving audio')
         raise ex
 
     return result
 
 
-def save_mp3(video_info_list, working_dir, album=None, track_number=0):
-    logging.info('Downloading and converting files to mp3, working directory - "%s"', os.path.abspath(working_dir))
+def store_audio(result, fsync=False):
+    """ moves converted audio into media store, audio has to be converted without album and track number tags """
+    try:
+        if result.get('embedded_tags') is None:
+            with measure('tag', result.get('id')):
+                util.add_audio_metainfo(result.get('audio_path'), cover_path=result.get('thumb_path'),
+                                        video_id=result.get('id'), title=result.get('title'),
+                                        artist=result.get('artist'))
+
+        result['audio_path'] = _media_store.put(result.get('id'), result.get('audio_path'), result, fsync=fsync)
+        result['embedded_tags'] = [None, None]
+        result['stored'] = True
+    except Exception as ex:
+        logging.error('An error occurred while saving audio into store')
+        raise ex
+
+    return result
+
+
+def link_stored_audio(result, targets, staging_dir, fsync=False):
+    """ saves audio from media store into every target directory as hard link to copy tagged for the target """
+    try:
+        end_filename = util.generate_video_title(result.get('title'), result.get('id'), result.get('audio_ext'),
+                                                 clean=True)
+
+        audio_paths = []
+        for target in targets:
+            audio_path = os.path.join(target['working_dir'], end_filename)
+
+            with measure('tag', result.get('id')):
+                variant_path = _media_store.get_variant(result.get('id'), target['album'], target['track_num'],
+                                                        staging_dir, fsync=fsync)
+            with measure('copy', result.get('id')):
+                util.link_or_copy(variant_path, audio_path, fsync=fsync)
+
+            index.get_index(target['working_dir']).add(end_filename, video_id=result.get('id'),
+                                                       album=target['album'], track_num=target['track_num'])
+            audio_paths.append(audio_path)
+
+        result['audio_filename'] = end_filename
+        result['audio_paths'] = audio_paths
+    except Exception as ex:
+        logging.error('An error occurred while saving audio from store')
+        raise ex
+
+    return result
 
-    for video_info in video_info_list:
-        try:
-            track_number += 1
 
-            result_info = download_data_from_video(video_info[VIDEO_ID], working_dir)
+def plan_batch(api_key, batch_entries, job_journal=None, newest_first=False, region=None, work_queue=None):
+    """ collects videos of all playlists, every video gets one task with all directories it is missing in
 
-            result_name = util.generate_video_title(result_info.get('title'), result_info.get('id'),
-                                                    result_info.get('audio_ext'), clean=True)
-            audio_path = os.path.join(working_dir, result_name)
-            cover_path = os.path.join(working_dir, constants.ROOT_TEMP_DIR, constants.IMAGE_TEMP_DIR,
-                                      result_info.get('thumb_filename'))
-            util.add_audio_metainfo(audio_path, cover_path=cover_path, track_num=track_number, album=album)
+    videos which are already queued for the same directory are not planned again
+    """
+    logging.info('Planning batch of %d playlists', len(batch_entries))
+
+    tasks = OrderedDict()
+    track_numbers = dict()
+
+    for entry in batch_entries:
+        try:
+            working_dir = entry['folder']
+            album = entry['album']
+            if not os.path.exists(working_dir):
+                os.makedirs(working_dir)
+
+            known_ids = util.get_local_video_ids(working_dir) if newest_first else None
+            queued_ids = work_queue.video_ids(working_dir) if work_queue else set()
+            videos = get_videos_from_playlist(api_key, entry['playlist'], known_ids=known_ids)
+            video_info_list = (video_info for video_info in get_playlist_video_info(synchronize_audios(videos,
+                                                                                                   working_dir))
+                               if video_info[VIDEO_ID] not in queued_ids)
+            for video_info in get_playable_videos(api_key, video_info_list, region=region):
+                task = tasks.setdefault(video_info[VIDEO_ID], {VIDEO_ID: video_info[VIDEO_ID],
+                                                               DURATION: video_info.get(DURATION), 'targets': []})
+                if any(target['working_dir'] == working_dir for target in task['targets']):
+                    continue
+
+                album_key = (working_dir, album)
+                if album_key not in track_numbers:
+                    track_numbers[album_key] = util.get_last_track_number(working_dir=working_dir, album=album)
+                    if job_journal:
+                        track_numbers[album_key] = max(track_numbers[album_key],
+                                                       job_journal.get_last_track_number(working_dir, album))
+                    if work_queue:
+                        track_numbers[album_key] = max(track_numbers[album_key],
+                                                       work_queue.get_last_track_number(working_dir, album))
+                track_numbers[album_key] += 1
+
+                task['targets'].append(make_target(working_dir, album, track_numbers[album_key]))
         except Exception as e:
-            logging.error('An error occurred while downloading or converting video - "%s". Skipping it',
-                          video_info[VIDEO_ID])
+            logging.error('An error occurred while planning playlist - "%s". Skipping it', entry['playlist'])
             logging.exception(e)
 
-    logging.info('Finished downloading and converting audio from all videos, downloaded videos = %d',
-                 len(video_info_list))
+    logging.info('Batch planned, unique videos to download = %d', len(tasks))
+
+    return list(tasks.values())
+
+
+def make_tasks(video_info_list, working_dir, album=None, track_number=0):
+    """ yields task of every video, tagged with next track numbers after track_number """
+    # track numbers are assigned in playlist order before any work starts, so they do not depend on
+    # which download finishes first
+    # playlist could contain the same video several times, every video is saved once
+    seen_ids = set()
+    for video_info in video_info_list:
+        if video_info[VIDEO_ID] in seen_ids:
+            continue
+        seen_ids.add(video_info[VIDEO_ID])
+
+        track_number += 1
+        yield {VIDEO_ID: video_info[VIDEO_ID], DURATION: video_info.get(DURATION),
+               'targets': [make_target(working_dir, album, track_number)]}
+
+
+def save_mp3(video_info_list, working_dir, album=None, track_number=0, jobs=constants.DEFAULT_JOBS,
+             job_journal=None, audio_format=constants.DEFAULT_AUDIO_FORMAT, transcode=True, fsync=False,
+             temp_root=None, profile=constants.DEFAULT_ENCODER_PROFILE, ffmpeg_threads=None, convert_jobs=None):
+    # numbers taken by videos left from interrupted run are not given again
+    if job_journal:
+        track_number = max(track_number, job_journal.get_last_track_number(working_dir, album))
+
+    tasks = make_tasks(video_info_list, working_dir, album, track_number)
+
+    save_tasks(tasks, temp_root or working_dir, jobs=jobs, job_journal=job_journal, audio_format=audio_format,
+               transcode=transcode, fsync=fsync, profile=profile, ffmpeg_threads=ffmpeg_threads,
+               convert_jobs=convert_jobs)
+
+
+def enqueue_tasks(work_queue, tasks):
+    """ puts tasks into work queue, returns number of tasks """
+    queued = 0
+    for task in tasks:
+        work_queue.enqueue(task[VIDEO_ID], task)
+        queued += 1
+
+    logging.info('Tasks put into work queue - %d, queue state - %s', queued, work_queue.counts())
+
+    return queued
+
+
+def get_queued_tasks(work_queue, owner, poll_interval=constants.QUEUE_POLL_INTERVAL):
+    """ yields tasks leased from work queue until nothing is queued or leased by other workers """
+    while True:
+        tasks = work_queue.lease(owner)
+        for task in tasks:
+            yield task
+        if tasks:
+            continue
+
+        counts = work_queue.counts()
+        if not counts.get(workqueue.STATE_QUEUED) and not counts.get(workqueue.STATE_LEASED):
+            return
+
+        # tasks leased by other workers are taken over if their leases expire
+        time.sleep(poll_interval)
+
+
+def drain_queue(work_queue, owner, temp_root, **kwargs):
+    """ saves tasks from work queue until it is empty, every task is acknowledged when it is saved or failed
+
+    kwargs are options of save_tasks
+    """
+    logging.info('Working on tasks from work queue as "%s", queue state - %s', owner, work_queue.counts())
+
+    stopped = threading.Event()
+
+    def renew_leases():
+        # tasks waiting in pipeline queues or downloading long videos keep their leases
+        while not stopped.wait(constants.QUEUE_LEASE_TIMEOUT / 3.0):
+            work_queue.renew(owner)
+
+    def on_done(task):
+        if not work_queue.ack(task[VIDEO_ID], owner, {'title': task.get('title'),
+                                                      'audio_paths': task.get('audio_paths')}):
+            logging.warning('Lease of video "%s" expired before it was saved', task[VIDEO_ID])
+
+    def on_error(stage_name, task, ex):
+        if not work_queue.nack(task[VIDEO_ID], owner):
+            logging.warning('Lease of video "%s" expired before it failed', task[VIDEO_ID])
+
+    renew_thread = threading.Thread(target=renew_leases, name='lease-renew')
+    renew_thread.daemon = True
+    renew_thread.start()
+    try:
+        save_tasks(get_queued_tasks(work_queue, owner), temp_root, on_done=on_done, on_error=on_error, **kwargs)
+    finally:
+        stopped.set()
+        renew_thread.join()
+
+    logging.info('Work queue drained, queue state - %s', work_queue.counts())
+
+
+def resume_tasks(job_journal, tasks):
+    """ yields unfinished tasks of previous run first, then new tasks which are not in journal yet """
+    pending = job_journal.pending_tasks()
+    if pending:
+        logging.info('Resuming unfinished run, videos left from previous run = %d', len(pending))
+
+    # videos failed too many times are not retried until journal is pruned
+    pending_ids = job_journal.failed_ids()
+    for task in pending:
+        pending_ids.add(task[VIDEO_ID])
+        yield task
+
+    for task in tasks:
+        if task[VIDEO_ID] in pending_ids:
+            continue
+        job_journal.queue(task[VIDEO_ID], task)
+        yield task
+
+
+def save_tasks(tasks, temp_root, jobs=constants.DEFAULT_JOBS, job_journal=None,
+               audio_format=constants.DEFAULT_AUDIO_FORMAT, transcode=True, fsync=False,
+               profile=constants.DEFAULT_ENCODER_PROFILE, ffmpeg_threads=None, convert_jobs=None, on_done=None,
+               on_error=None):
+    """ downloads, converts and saves audio of every task, temp files are kept in temp_root
+
+    downloads run in jobs threads and ffmpeg processes in convert_jobs threads, one per cpu core by default,
+    on_done(task) and on_error(stage_name, task, ex) are called when task is saved or failed
+    """
+    convert_jobs = convert_jobs or os.cpu_count() or 1
+    staging_dir = os.path.join(temp_root, constants.ROOT_TEMP_DIR, constants.AUDIO_TEMP_DIR)
+
+    logging.info('Downloading and converting files to %s, temp directory root - "%s", jobs - %d, '
+                 'convert jobs - %d, encoder profile - %s', audio_format, os.path.abspath(temp_root), jobs,
+                 convert_jobs, profile)
+
+    if transcode:
+        source_format = 'bestaudio'
+    elif audio_format in constants.YTDL_COPY_FORMATS:
+        # stream already encoded with target codec, it is only remuxed into output container
+        source_format = constants.YTDL_COPY_FORMATS[audio_format]
+    else:
+        raise ValueError('Audio format could not be saved without transcoding - {0}'.format(audio_format))
+
+    def completed_before(task, stage, *paths):
+        if not job_journal:
+            return None
+        journal_stage, journal_task = job_journal.get(task[VIDEO_ID])
+        if not journal.is_completed(journal_stage, stage):
+            return None
+        if not all(journal_task.get(path) and os.path.exists(journal_task.get(path)) for path in paths):
+            return None
+        return journal_task
+
+    def record(task, stage):
+        if job_journal:
+            job_journal.update(task[VIDEO_ID], task, stage)
+
+    def download(task):
+        stored_info = _media_store.get_info(task[VIDEO_ID]) if _media_store else None
+        if stored_info:
+            logging.info('Audio found in store, skipping download and conversion - "%s"', task[VIDEO_ID])
+            task.update(stored_info)
+            task['stored'] = True
+            return task
+
+        journal_task = completed_before(task, journal.STAGE_DOWNLOADED, 'audio_path', 'thumb_path')
+        if journal_task:
+            logging.info('Audio was downloaded by previous run, skipping download - "%s"', task[VIDEO_ID])
+            task.update(journal_task)
+            return task
+
+        task.update(download_data_from_video(task[VIDEO_ID], temp_root, source_format=source_format,
+                                             duration=task.get(DURATION)))
+        record(task, journal.STAGE_DOWNLOADED)
+        return task
+
+    def convert(task):
+        if task.get('stored'):
+            return task
+        if completed_before(task, journal.STAGE_CONVERTED, 'audio_path'):
+            logging.info('Audio was converted by previous run, skipping conversion - "%s"', task[VIDEO_ID])
+            return task
+
+        # stored audio is shared by albums, it is converted without album tags
+        target = make_target(None) if _media_store else task['targets'][0]
+        task = convert_audio_from_video(task, temp_root, audio_format=audio_format, transcode=transcode,
+                                        target=target, profile=profile, threads=ffmpeg_threads)
+        if _media_store:
+            task = store_audio(task, fsync=fsync)
+        record(task, journal.STAGE_CONVERTED)
+        return task
+
+    def tag(task):
+        if task.get('stored'):
+            task = link_stored_audio(task, task['targets'], staging_dir, fsync=fsync)
+        else:
+            task = finalize_audio(task, task['targets'], fsync=fsync)
+        record(task, journal.STAGE_TAGGED)
+        # temp files are removed as soon as audio is saved, not at the end of the run
+        util.remove_temp_files(temp_root, task[VIDEO_ID])
+        if _disk_budget:
+            _disk_budget.release(task[VIDEO_ID])
+        return task
+
+    def on_task_error(stage_name, task, ex):
+        if _disk_budget:
+            _disk_budget.release(task[VIDEO_ID])
+        if job_journal and job_journal.fail(task[VIDEO_ID]):
+            logging.error('Video failed %d times, it is not retried - "%s"', constants.MAX_ATTEMPT, task[VIDEO_ID])
+            util.remove_temp_files(temp_root, task[VIDEO_ID])
+        if _run_metrics:
+            _run_metrics.record_failure(stage_name, task[VIDEO_ID])
+        logging.error('An error occurred while downloading or converting video - "%s". Skipping it',
+                      task[VIDEO_ID])
+        logging.exception(ex)
+        if on_error:
+            on_error(stage_name, task, ex)
+
+    if job_journal:
+        tasks = resume_tasks(job_journal, tasks)
+
+    audio_pipeline = pipeline.Pipeline([
+        pipeline.Stage('download', download, workers=jobs),
+        pipeline.Stage('convert', convert, workers=convert_jobs),
+        pipeline.Stage('tag', tag, workers=1),
+    ], on_done=on_done, on_error=on_task_error)
+
+    done, failed = audio_pipeline.run(tasks)
+
+    logging.info('Finished downloading and converting audio from all videos, downloaded videos = %d, failed = %d',
+                 len(done), len(failed))
+
+    # copies of audios removed from all working directories are not kept forever
+    if _media_store:
+        _media_store.clean()
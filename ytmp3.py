@@ -2,11 +2,13 @@ import argparse
 import logging
 import os
 import re
-import sys
+import shutil
+import signal
+import socket
+import threading
 import traceback
 
-import core.util as util
-import core.youtubeservice as youtubeservice
+import core.constants as constants
 
 
 parser = argparse.ArgumentParser(description='This script finds all videos from Youtube given playlist')
@@ -14,10 +16,41 @@ parser = argparse.ArgumentParser(description='This script finds all videos from
 parser.add_argument('-k', '--key', dest='key', action='store', required=False, help='Google Data API key.')
 parser.add_argument('-f', '--folder', dest='folder', action='store', required=False, help='Working directory, where to download and store files, absolute path')
 parser.add_argument('-a', '--album', dest='album', action='store', required=False, help='Album name to save tracks with, also makes sync only with album if exist')
+parser.add_argument('--no-cache', dest='no_cache', action='store_true', default=False, help='Do not use cached playlist responses, request all pages again')
+parser.add_argument('--restart', dest='restart', action='store_true', default=False, help='Discard unfinished previous run and its temp files instead of resuming it')
+parser.add_argument('--format', dest='audio_format', action='store', choices=constants.OUTPUT_AUDIO_FORMATS, default=constants.DEFAULT_AUDIO_FORMAT, help='Audio format to save tracks in')
+parser.add_argument('--no-transcode', dest='no_transcode', action='store_true', default=False, help='Save audio stream without re-encoding, only remux it into format container (m4a and opus only)')
+parser.add_argument('--profile', dest='profile', action='store', choices=sorted(constants.ENCODER_PROFILES), default=constants.DEFAULT_ENCODER_PROFILE, help='Encoder profile, vbr or cbr and bitrate of converted audio')
+parser.add_argument('--ffmpeg-threads', dest='ffmpeg_threads', action='store', type=int, default=None, help='Number of threads of every ffmpeg process, ffmpeg decides by default')
+parser.add_argument('--convert-jobs', dest='convert_jobs', action='store', type=int, default=None, help='Number of audios converted in parallel, number of cpu cores by default')
+parser.add_argument('--store', dest='store', action='store', default=None, help='Shared directory to keep converted audios once per video and encoder profile, working directories get hard links to them')
+parser.add_argument('--temp-dir', dest='temp_dir', action='store', default=None, help='Directory to keep temp files in instead of working directory, e.g. tmpfs mount')
+parser.add_argument('--disk-budget', dest='disk_budget', action='store', type=int, default=None, help='Maximum size of temp files of videos in progress, megabytes, half of free space of temp directory by default')
+parser.add_argument('--fsync', dest='fsync', action='store_true', default=False, help='Flush saved audios to disk before they are renamed into working directory')
+parser.add_argument('--thumb-size', dest='thumb_size', action='store', type=int, default=None, help='Downscale cover images to this width in pixels before embedding them')
+parser.add_argument('--thumb-cache-size', dest='thumb_cache_size', action='store', type=int, default=constants.THUMB_CACHE_MAX_BYTES // (1024 * 1024), help='Size limit of thumbnails cache shared between runs, megabytes')
+parser.add_argument('--host-rate', dest='host_rate', action='store', type=float, default=constants.SCHEDULER_HOST_RATE, help='Maximum number of requests per second to a single host')
+parser.add_argument('--max-connections', dest='max_connections', action='store', type=int, default=constants.SCHEDULER_MAX_CONCURRENCY, help='Maximum number of concurrent network operations')
+parser.add_argument('--fragments', dest='fragments', action='store', type=int, default=1, help='Number of fragments of a stream downloaded concurrently, streams which are not fragmented are downloaded by ranges')
+parser.add_argument('--bandwidth', dest='bandwidth', action='store', default=None, help='Maximum download rate of all downloads and thumbnails together, bytes per second with optional K, M or G suffix, e.g. 2M')
+parser.add_argument('--bandwidth-schedule', dest='bandwidth_schedule', action='store', default=None, help='Download rates for time windows of local time, --bandwidth is used outside of them, e.g. 09:00-18:00=2M,18:00-20:00=5M')
+parser.add_argument('--report', dest='report', action='store', default=None, help='Path to save JSON report with timings of every stage per video')
+parser.add_argument('--prometheus', dest='prometheus', action='store', default=None, help='Path to save run metrics in Prometheus text format')
+parser.add_argument('--region', dest='region', action='store', default=None, help='Two letter country code, videos blocked in this country are skipped')
+parser.add_argument('--watch', dest='watch', action='store', type=int, default=None, metavar='INTERVAL', help='Keep running and synchronize playlists every INTERVAL seconds')
+parser.add_argument('--newest-first', dest='newest_first', action='store_true', default=False, help='Playlists have newest videos first, stop paging at first page without new videos')
+parser.add_argument('-j', '--jobs', dest='jobs', action='store', type=int, default=1, required=False, help='Number of videos to download and convert in parallel')
+
+parser.add_argument('--queue', dest='queue', action='store', default=None, help='Path to work queue database shared by producer and workers, e.g. on shared file system')
 
-linkIdType = parser.add_mutually_exclusive_group(required=True)
+queueRole = parser.add_mutually_exclusive_group()
+queueRole.add_argument('--produce', dest='produce', action='store_true', default=False, help='Put videos missing in working directories into work queue instead of downloading them')
+queueRole.add_argument('--work', dest='work', action='store_true', default=False, help='Download and save videos taken from work queue until it is empty')
+
+linkIdType = parser.add_mutually_exclusive_group()
 linkIdType.add_argument('-p', '--playlist', dest='playlist', action='store', help='Youtube playlist id to get videos from')
 linkIdType.add_argument('-s', '--single', dest='single', action='store', help='Youtube video id to download')
+linkIdType.add_argument('-b', '--batch', dest='batch', action='store', help='File with playlists to download, every line is "playlist id[,album[,folder]]"')
 
 outputDetailLevel = parser.add_mutually_exclusive_group()
 outputDetailLevel.add_argument('-q', '--quiet', dest='quiet', action='store_true', default=False, help='Print out minimum result information, errors')
@@ -26,6 +59,25 @@ outputDetailLevel.add_argument('-d', '--debug', dest='debug', action='store_true
 
 args = parser.parse_args()
 
+# imported after arguments are parsed, so '-h' and wrong arguments do not wait for them
+import core.cache as cache
+import core.downloader.session as session
+import core.index as index
+import core.journal as journal
+import core.metrics as metrics
+import core.scheduler as scheduler
+import core.store as store
+import core.thumbcache as thumbcache
+import core.util as util
+import core.workqueue as workqueue
+import core.youtubeservice as youtubeservice
+
+try:
+    bandwidth = scheduler.parse_rate(args.bandwidth) if args.bandwidth else None
+    bandwidth_schedule = scheduler.parse_bandwidth_schedule(args.bandwidth_schedule) if args.bandwidth_schedule else None
+except ValueError as ex:
+    parser.error(str(ex))
+
 
 if args.debug:
     LOG_LEVEL = logging.DEBUG
@@ -41,34 +93,244 @@ if args.folder is None:
 else:
     working_dir = re.sub('["|\']+', '', args.folder)
 
+temp_root = working_dir if args.temp_dir is None else re.sub('["|\']+', '', args.temp_dir)
+# name of queue worker, its leases and temp directory
+worker_name = '{0}-{1}'.format(socket.gethostname(), os.getpid())
+if args.work:
+    temp_root = os.path.join(temp_root, constants.WORKER_TEMP_DIR_FRMT.format(worker_name))
+
+if not args.work and not (args.playlist or args.single or args.batch):
+    parser.error('one of the arguments -p/--playlist -s/--single -b/--batch is required')
+if args.work and (args.playlist or args.single or args.batch):
+    parser.error('--work takes videos from work queue, -p/--playlist -s/--single -b/--batch are not allowed')
+if bool(args.queue) != (args.produce or args.work):
+    parser.error('--queue requires one of --produce or --work and they require --queue')
+if args.jobs < 1:
+    parser.error('number of jobs must be positive')
+if args.fragments < 1:
+    parser.error('number of fragments must be positive')
+if args.host_rate <= 0 or args.max_connections < 1:
+    parser.error('host rate and max connections must be positive')
+if args.thumb_cache_size < 1:
+    parser.error('thumbnail cache size must be positive')
+if args.thumb_size is not None and args.thumb_size < 1:
+    parser.error('thumbnail size must be positive')
+if args.convert_jobs is not None and args.convert_jobs < 1 or args.ffmpeg_threads is not None and args.ffmpeg_threads < 1:
+    parser.error('number of convert jobs and ffmpeg threads must be positive')
+if args.region is not None:
+    args.region = args.region.upper()
+if args.disk_budget is not None and args.disk_budget < 1:
+    parser.error('disk budget must be positive')
+if args.watch is not None and args.watch < 1:
+    parser.error('watch interval must be positive')
+if args.watch is not None and args.single:
+    parser.error('--watch is supported only with playlists')
+if args.no_transcode and args.audio_format not in constants.YTDL_COPY_FORMATS:
+    parser.error('--no-transcode is supported only with formats: {0}'.format(', '.join(constants.YTDL_COPY_FORMATS)))
+
 
 def main():
+    response_cache = None
+    job_journal = None
+    work_queue = None
+    # temp files are kept when run was interrupted, so next run could resume it
+    completed = False
+    run_metrics = metrics.RunMetrics()
+    youtubeservice.set_run_metrics(run_metrics)
     try:
-        util.clean_temp_dir(working_dir)
-        util.create_temp_dir(working_dir)
+        if args.restart:
+            util.clean_temp_dir(temp_root)
+        util.create_temp_dir(temp_root)
+        job_journal = journal.JobJournal(journal.get_journal_path(temp_root))
+        youtubeservice.set_disk_budget(scheduler.DiskBudget(get_disk_budget()))
+        if args.store:
+            youtubeservice.set_media_store(store.MediaStore(
+                re.sub('["|\']+', '', args.store), store.get_store_profile(args.profile, not args.no_transcode),
+                args.audio_format))
+        scheduler.configure_scheduler(max_concurrency=args.max_connections, host_rate=args.host_rate)
+        scheduler.configure_bandwidth(bandwidth, bandwidth_schedule)
+        if args.fragments > 1:
+            youtubeservice.set_ytdl_options({
+                'concurrent_fragment_downloads': args.fragments,
+                'http_chunk_size': constants.HTTP_CHUNK_SIZE
+            })
+        youtubeservice.set_thumb_cache(thumbcache.ThumbCache(
+            os.path.join(util.get_cache_dir(), constants.THUMB_CACHE_DIR_NAME),
+            max_bytes=args.thumb_cache_size * 1024 * 1024,
+            max_width=args.thumb_size))
 
-        if args.playlist:
+        if args.playlist or args.batch:
             if not args.key:
                 logging.error("Please specify Google Data API key when you're using playlist downloader")
                 exit()
-            descr = youtubeservice.get_playlist_info(args.key, args.playlist)
-            all_videos = youtubeservice.get_videos_from_playlist(args.key, args.playlist)
-            filtered_videos = youtubeservice.synchronize_audios(all_videos, working_dir)
-            video_info_list = youtubeservice.get_playlist_video_info(filtered_videos)
-        else:
-            video_info_list = youtubeservice.get_single_video_urls(args.single)
+            if not args.no_cache:
+                response_cache = cache.ResponseCache(os.path.join(util.get_cache_dir(), constants.CACHE_FILENAME))
+                youtubeservice.set_response_cache(response_cache)
 
-        if len(video_info_list) < 1:
-            logging.info("No audios to download. All items are synchronized.")
-            sys.exit()
+        if args.queue:
+            work_queue = workqueue.WorkQueue(re.sub('["|\']+', '', args.queue))
 
-        last_track_number = util.get_last_track_number(working_dir=working_dir, album=args.album)
-        youtubeservice.save_mp3(video_info_list, working_dir, args.album, last_track_number)
+        if args.work:
+            run = lambda: work(work_queue)
+        elif args.produce:
+            run = lambda: produce(work_queue)
+        else:
+            run = lambda: sync(job_journal)
+
+        if args.watch:
+            watch(run, job_journal, run_metrics, response_cache)
+        else:
+            run()
+        completed = True
     except Exception as e:
         logging.error('Something went wrong, %s', str(e))
         logging.debug(traceback.print_exc())
     finally:
-        util.clean_temp_dir(working_dir)
+        if response_cache:
+            response_cache.close()
+        index.close_indexes()
+        session.close_default_session()
+        if job_journal:
+            job_journal.close()
+        if work_queue:
+            work_queue.close()
+        if completed:
+            util.clean_temp_dir(temp_root)
+            if args.work and not os.listdir(temp_root):
+                os.rmdir(temp_root)
+        else:
+            logging.info('Run was not completed, temp files are kept to resume it next time')
+        # service saves report of every synchronization itself
+        if not args.watch:
+            save_run_report(run_metrics)
+
+
+def sync(job_journal):
+    """ downloads and saves all videos which are missing in working directory """
+    if args.batch:
+        batch_entries = util.read_batch_file(args.batch, default_folder=working_dir)
+        tasks = youtubeservice.plan_batch(args.key, batch_entries, job_journal=job_journal,
+                                          newest_first=args.newest_first, region=args.region)
+        if not tasks and not job_journal.pending_tasks():
+            logging.info("No audios to download. All items are synchronized.")
+            return
+
+        youtubeservice.save_tasks(tasks, temp_root, jobs=args.jobs, job_journal=job_journal,
+                                  audio_format=args.audio_format, transcode=not args.no_transcode,
+                                  fsync=args.fsync, profile=args.profile, ffmpeg_threads=args.ffmpeg_threads,
+                                  convert_jobs=args.convert_jobs)
+        return
+
+    video_info_list = get_video_info_list()
+
+    # playlist is paged lazily, only first item is requested here
+    first_video_info, video_info_list = util.peek(video_info_list)
+    if first_video_info is None and not job_journal.pending_tasks():
+        logging.info("No audios to download. All items are synchronized.")
+        return
+
+    last_track_number = util.get_last_track_number(working_dir=working_dir, album=args.album)
+    youtubeservice.save_mp3(video_info_list, working_dir, args.album, last_track_number, jobs=args.jobs,
+                            job_journal=job_journal, audio_format=args.audio_format,
+                            transcode=not args.no_transcode, fsync=args.fsync, temp_root=temp_root,
+                            profile=args.profile, ffmpeg_threads=args.ffmpeg_threads, convert_jobs=args.convert_jobs)
+
+
+def get_video_info_list(skip_ids=None):
+    """ lists videos of playlist which are missing in working directory or single video """
+    if not args.playlist:
+        return youtubeservice.get_single_video_urls(args.single)
+
+    descr = youtubeservice.get_playlist_info(args.key, args.playlist)
+    known_ids = util.get_local_video_ids(working_dir) if args.newest_first else None
+    all_videos = youtubeservice.get_videos_from_playlist(args.key, args.playlist, known_ids=known_ids)
+    filtered_videos = youtubeservice.synchronize_audios(all_videos, working_dir)
+    video_info_list = youtubeservice.get_playlist_video_info(filtered_videos)
+    if skip_ids:
+        video_info_list = (video_info for video_info in video_info_list
+                           if video_info[youtubeservice.VIDEO_ID] not in skip_ids)
+
+    return youtubeservice.get_playable_videos(args.key, video_info_list, region=args.region)
+
+
+def produce(work_queue):
+    """ puts videos missing in working directories into work queue, workers download them """
+    if args.batch:
+        batch_entries = util.read_batch_file(args.batch, default_folder=working_dir)
+        tasks = youtubeservice.plan_batch(args.key, batch_entries, newest_first=args.newest_first,
+                                          region=args.region, work_queue=work_queue)
+    else:
+        # videos queued before for this directory and their track numbers are not given again
+        video_info_list = get_video_info_list(skip_ids=work_queue.video_ids(working_dir))
+        last_track_number = max(util.get_last_track_number(working_dir=working_dir, album=args.album),
+                                work_queue.get_last_track_number(working_dir, args.album))
+        tasks = youtubeservice.make_tasks(video_info_list, working_dir, args.album, last_track_number)
+
+    youtubeservice.enqueue_tasks(work_queue, tasks)
+
+
+def work(work_queue):
+    """ downloads and saves videos from work queue, working directories of videos are taken from the queue """
+    youtubeservice.drain_queue(work_queue, worker_name, temp_root, jobs=args.jobs, audio_format=args.audio_format,
+                               transcode=not args.no_transcode, fsync=args.fsync, profile=args.profile,
+                               ffmpeg_threads=args.ffmpeg_threads, convert_jobs=args.convert_jobs)
+
+
+def watch(run, job_journal, run_metrics, response_cache=None):
+    """ runs synchronization until stopped, connections, youtube-dl instances and caches stay warm """
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logging.info('Stop requested, finishing current synchronization')
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+
+    cycle = 0
+    while not stop.is_set():
+        cycle += 1
+        logging.info('Synchronization %d started', cycle)
+        # service keeps running, so report and caches must not grow with every synchronization
+        run_metrics.reset()
+        try:
+            # files could be added or removed by someone else since last synchronization
+            index.refresh_indexes()
+            run()
+            # saved videos are not kept in journal of long running service, failed ones are retried later
+            job_journal.prune()
+            if not job_journal.pending_tasks():
+                util.clean_temp_files(temp_root)
+        except Exception as e:
+            logging.error('Synchronization failed, next one in %d seconds, %s', args.watch, str(e))
+            logging.debug(traceback.format_exc())
+        save_run_report(run_metrics)
+        if response_cache:
+            response_cache.evict()
+
+        stop.wait(args.watch)
+
+
+def get_disk_budget():
+    if args.disk_budget is not None:
+        return args.disk_budget * 1024 * 1024
+
+    free_space = shutil.disk_usage(os.path.join(temp_root, constants.ROOT_TEMP_DIR)).free
+    disk_budget = int(free_space * constants.DISK_BUDGET_FREE_FRACTION)
+    logging.info('Temp files disk budget - %d MB', disk_budget // (1024 * 1024))
+
+    return disk_budget
+
+
+def save_run_report(run_metrics):
+    run_metrics.finish()
+    run_metrics.log_summary()
+    try:
+        if args.report:
+            run_metrics.write_json(args.report)
+        if args.prometheus:
+            run_metrics.write_prometheus(args.prometheus)
+    except Exception as e:
+        logging.error('Could not save run report, %s', str(e))
 
 
 if __name__ == '__main__':